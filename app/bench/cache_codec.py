@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.bench.fake_api import FakeApiOptions, FakeYouTubeApi
+from app.services.youtube import normalize_comment
+from app.storage.cache_codec import decode_comments, encode_comments, encode_legacy
+
+# Size and encode/decode time of the columnar cache format against the old JSON+zlib blobs,
+# on the fake API's synthetic comments.
+
+
+def sample_comments(count: int, include_replies: bool = True, seed: int = 0) -> List[Dict]:
+    api = FakeYouTubeApi(FakeApiOptions(seed=seed))
+    video_id = f"codec{seed}"
+    comments: List[Dict] = []
+    index = 0
+    while len(comments) < count:
+        thread = api.thread(video_id, index, include_replies)
+        top = thread["snippet"]["topLevelComment"]
+        comments.append(normalize_comment(top, video_id, None, thread["snippet"]["totalReplyCount"]))
+        if include_replies:
+            for j in range(api.reply_count(video_id, index)):
+                comments.append(normalize_comment(api.reply(top["id"], index, j), video_id, top["id"]))
+        index += 1
+    return comments[:count]
+
+
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark cache blob encodings")
+    parser.add_argument("--sizes", default="1000,5000,20000")
+    parser.add_argument("--replies", choices=["off", "on"], default="on")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'comments':>9} {'format':<9} {'bytes':>10} {'encode ms':>10} {'decode ms':>10}")
+    for size in [int(v) for v in args.sizes.split(",") if v.strip()]:
+        comments = sample_comments(size, args.replies == "on")
+        for name, encode in (("json+zlib", encode_legacy), ("columnar", encode_comments)):
+            blob = encode(comments)
+            if decode_comments(blob) != comments:
+                raise RuntimeError(f"{name} blob does not round-trip")
+            encode_s = best_of(lambda: encode(comments), args.repeat)
+            decode_s = best_of(lambda: decode_comments(blob), args.repeat)
+            print(f"{size:>9} {name:<9} {len(blob):>10} {encode_s * 1000:>10.1f} {decode_s * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+# Offline stand-in for the commentThreads and comments endpoints. Every video id has the same
+# synthetic, deterministic listing, so benchmarks can use a fresh id per run to skip the cache.
+
+_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+INLINE_REPLIES = 5
+PAGE_SIZE = 100
+
+
+@dataclass
+class FakeApiOptions:
+    threads: int = 2000
+    # share of threads that have replies, and the most replies one thread can have
+    reply_ratio: float = 0.3
+    max_replies: int = 20
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # chance of a retryable 503 backendError / 403 rateLimitExceeded per request
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    quota_error_rate: float = 0.0
+    seed: int = 0
+
+
+def _error(status: int, reason: str) -> web.Response:
+    body = {"error": {"code": status, "message": reason, "errors": [{"reason": reason}]}}
+    return web.json_response(body, status=status)
+
+
+def _page_bounds(request: web.Request, total: int) -> Tuple[int, int]:
+    try:
+        start = int(request.query.get("pageToken") or 0)
+        size = int(request.query.get("maxResults") or 20)
+    except ValueError:
+        raise web.HTTPBadRequest(text="invalid pageToken or maxResults")
+    return start, min(start + max(1, min(size, PAGE_SIZE)), total)
+
+
+class FakeYouTubeApi:
+    def __init__(self, options: FakeApiOptions):
+        self.options = options
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(options.seed)
+
+    def reply_count(self, video_id: str, index: int) -> int:
+        rng = random.Random(f"{self.options.seed}:{video_id}:{index}")
+        if rng.random() >= self.options.reply_ratio:
+            return 0
+        return rng.randint(1, max(self.options.max_replies, 1))
+
+    def _comment(self, comment_id: str, index: int) -> Dict:
+        rng = random.Random(f"{self.options.seed}:{comment_id}")
+        words = " ".join(f"word{rng.randint(0, 500)}" for _ in range(rng.randint(3, 40)))
+        snippet = {
+            "authorDisplayName": f"author{rng.randint(0, 5000)}",
+            "publishedAt": (_EPOCH - timedelta(minutes=index)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "likeCount": rng.randint(0, 1000) if rng.random() < 0.2 else rng.randint(0, 5),
+            "textDisplay": words,
+            "textOriginal": words,
+        }
+        return {"id": comment_id, "snippet": snippet}
+
+    def thread(self, video_id: str, index: int, with_replies: bool) -> Dict:
+        top_id = f"{video_id}.{index}"
+        count = self.reply_count(video_id, index)
+        thread = {"snippet": {"totalReplyCount": count, "topLevelComment": self._comment(top_id, index)}}
+        if with_replies and count:
+            inline = min(count, INLINE_REPLIES)
+            thread["replies"] = {"comments": [self.reply(top_id, index, j) for j in range(inline)]}
+        return thread
+
+    def reply(self, top_id: str, index: int, j: int) -> Dict:
+        return self._comment(f"{top_id}.{j}", index)
+
+    async def _delay_or_fail(self) -> Optional[web.Response]:
+        self.requests += 1
+        o = self.options
+        if o.latency_ms or o.jitter_ms:
+            await asyncio.sleep(max(0.0, o.latency_ms + self._rng.uniform(-o.jitter_ms, o.jitter_ms)) / 1000)
+        roll = self._rng.random()
+        for rate, status, reason in (
+            (o.error_rate, 503, "backendError"),
+            (o.rate_limit_rate, 403, "rateLimitExceeded"),
+            (o.quota_error_rate, 403, "quotaExceeded"),
+        ):
+            if roll < rate:
+                self.errors += 1
+                return _error(status, reason)
+            roll -= rate
+        return None
+
+    async def comment_threads(self, request: web.Request) -> web.Response:
+        failure = await self._delay_or_fail()
+        if failure is not None:
+            return failure
+        video_id = request.query.get("videoId")
+        if not video_id:
+            return _error(400, "missingRequiredParameter")
+        with_replies = "replies" in request.query.get("part", "")
+        start, end = _page_bounds(request, self.options.threads)
+        body: Dict = {"items": [self.thread(video_id, i, with_replies) for i in range(start, end)]}
+        if end < self.options.threads:
+            body["nextPageToken"] = str(end)
+        return web.json_response(body)
+
+    async def comments(self, request: web.Request) -> web.Response:
+        failure = await self._delay_or_fail()
+        if failure is not None:
+            return failure
+        parent_id = request.query.get("parentId", "")
+        video_id, _, index = parent_id.rpartition(".")
+        if not video_id or not index.isdigit():
+            return _error(404, "commentNotFound")
+        start, end = _page_bounds(request, self.reply_count(video_id, int(index)))
+        body: Dict = {"items": [self.reply(parent_id, int(index), j) for j in range(start, end)]}
+        if end < self.reply_count(video_id, int(index)):
+            body["nextPageToken"] = str(end)
+        return web.json_response(body)
+
+    def stats(self) -> Dict:
+        return {"requests": self.requests, "errors": self.errors}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/commentThreads", self.comment_threads)
+        app.router.add_get("/comments", self.comments)
+        return app
+
+
+class FakeApiServer:
+    # runs FakeYouTubeApi on its own event loop thread; base_url goes to YouTubeClient
+    def __init__(self, options: FakeApiOptions, host: str = "127.0.0.1", port: int = 0):
+        self.api = FakeYouTubeApi(options)
+        self.host = host
+        self.port = port
+        self._loop = asyncio.new_event_loop()
+        self._thread: Optional[threading.Thread] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> str:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        self.port = sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-youtube-api", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._serve(sock), self._loop).result()
+        return self.base_url
+
+    async def _serve(self, sock: socket.socket) -> None:
+        self._runner = web.AppRunner(self.api.app(), access_log=None)
+        await self._runner.setup()
+        await web.SockSite(self._runner, sock).start()
+
+    def stop(self) -> None:
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+        self._loop.close()
+
+    def __enter__(self) -> "FakeApiServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def add_options_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeApiOptions()
+    parser.add_argument("--threads", type=int, default=defaults.threads, help="comment threads per video")
+    parser.add_argument("--reply-ratio", type=float, default=defaults.reply_ratio)
+    parser.add_argument("--max-replies", type=int, default=defaults.max_replies)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="503 backendError rate")
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate, help="403 rateLimitExceeded rate")
+    parser.add_argument("--quota-error-rate", type=float, default=defaults.quota_error_rate, help="403 quotaExceeded rate")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def options_from_args(args: argparse.Namespace) -> FakeApiOptions:
+    return FakeApiOptions(
+        threads=args.threads,
+        reply_ratio=args.reply_ratio,
+        max_replies=args.max_replies,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        quota_error_rate=args.quota_error_rate,
+        seed=args.seed,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Fake YouTube Data API (commentThreads, comments)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_options_arguments(parser)
+    args = parser.parse_args(argv)
+    api = FakeYouTubeApi(options_from_args(args))
+    print(json.dumps({"base_url": f"http://{args.host}:{args.port}", "options": vars(args)}))
+    web.run_app(api.app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
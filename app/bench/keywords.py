@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import argparse
+import random
+import re
+from typing import Dict, Iterator, List, Optional
+
+from app.bench.cache_codec import best_of, sample_comments
+from app.services.filtering import filter_comments
+
+# Keyword filtering before and after compiling the keywords into one matcher, on the fake API's
+# synthetic comments. For `any` half of each keyword set occurs in the comments and half does
+# not; for `all` every keyword occurs somewhere.
+
+
+def legacy_filter(comments: List[Dict], keywords: List[str], mode: str, case_sensitive: bool) -> Iterator[Dict]:
+    # the per-keyword scan filter_comments used before
+    kw = [k if case_sensitive else k.lower() for k in keywords if k.strip()]
+    check = all if mode == "all" else any
+    return (
+        c
+        for c in comments
+        if check(k in (c.get("text", "") if case_sensitive else c.get("text", "").lower()) for k in kw)
+    )
+
+
+def keyword_set(comments: List[Dict], count: int, all_present: bool = False, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    vocabulary = sorted({w for c in comments[:2000] for w in re.findall(r"\w+", c.get("text", ""))})
+    present = rng.sample(vocabulary, min(len(vocabulary), count if all_present else (count + 1) // 2))
+    absent = [f"absent{i}" for i in range(count - len(present))]
+    # mixed case, so case-insensitive matching has work to do
+    return [w.capitalize() if i % 2 else w for i, w in enumerate(present + absent)]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark keyword filtering")
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--keywords", default="1,5,20,50,200")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    comments = sample_comments(args.comments)
+    print(f"{'keywords':>8} {'mode':<5} {'case':<6} {'matched':>8} {'legacy ms':>10} {'compiled ms':>12} {'speedup':>8}")
+    for count in [int(v) for v in args.keywords.split(",") if v.strip()]:
+        for mode in ("any", "all"):
+            keywords = keyword_set(comments, count, all_present=mode == "all")
+            for case_sensitive in (False, True):
+                expected = list(legacy_filter(comments, keywords, mode, case_sensitive))
+                if list(filter_comments(comments, keywords, mode, case_sensitive)) != expected:
+                    raise RuntimeError(f"compiled matcher disagrees ({count} keywords, {mode}, case={case_sensitive})")
+                legacy_s = best_of(lambda: list(legacy_filter(comments, keywords, mode, case_sensitive)), args.repeat)
+                compiled_s = best_of(lambda: list(filter_comments(comments, keywords, mode, case_sensitive)), args.repeat)
+                print(
+                    f"{count:>8} {mode:<5} {'on' if case_sensitive else 'off':<6} {len(expected):>8} "
+                    f"{legacy_s * 1000:>10.1f} {compiled_s * 1000:>12.1f} {legacy_s / compiled_s:>7.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
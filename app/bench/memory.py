@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import tracemalloc
+from typing import Callable, List, Optional
+
+from app.bench.cache_codec import best_of, sample_comments
+from app.services.filtering import apply_filters
+from app.storage.cache_codec import decode_comments, encode_comments
+
+# Resident size of decoded comments as the old dicts and as Comment records, on the fake API's
+# synthetic comments: both are decoded from the same cache blob, so the strings are equally
+# fresh and only the containers differ. Also times a filter and sort over each.
+
+
+def resident(build: Callable[[], List]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        rows = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del rows
+    return size
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark memory use of decoded comments")
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'comments':>8} {'type':<8} {'MB':>8} {'B/comment':>10} {'filter+sort ms':>15}")
+    for size in [int(v) for v in args.sizes.split(",") if v.strip()]:
+        blob = encode_comments(sample_comments(size))
+        builds = {
+            "dict": lambda: [c.to_dict() for c in decode_comments(blob)],
+            "Comment": lambda: decode_comments(blob),
+        }
+        for name, build in builds.items():
+            nbytes = resident(build)
+            rows = build()
+            elapsed = best_of(lambda: apply_filters(rows, min_len=10, sort="likes_desc", limit=500), args.repeat)
+            print(
+                f"{size:>8} {name:<8} {nbytes / 1e6:>8.1f} {nbytes / size:>10.0f} {elapsed * 1000:>15.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from app.bench.fake_api import FakeApiServer, add_options_arguments, options_from_args
+
+# End-to-end benchmark of fetch_and_export against the fake API. Needs a Redis it can write
+# job and cache keys to (REDIS_URL; better a spare database). Every run uses a new video id,
+# so nothing is served from the comment cache.
+
+
+def percentile(values: List[float], pct: float) -> float:
+    # nearest-rank, so small samples report a latency that actually happened
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _csv(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _cleanup(r, job_id: str, video_id: str) -> None:
+    keys = list(r.scan_iter(match=f"job:{job_id}:*")) + list(r.scan_iter(match=f"yt:comments:{video_id}:*"))
+    if keys:
+        r.delete(*keys)
+
+
+def run_case(base_url: str, r, limit: int, fmt: str, include_replies: bool, runs: int) -> Dict:
+    from app.services.youtube import YouTubeClient
+    from app.workers.tasks import fetch_and_export
+
+    latencies: List[float] = []
+    comments = 0
+    for _ in range(runs):
+        job_id = f"bench-{uuid.uuid4().hex[:12]}"
+        video_id = f"bench{uuid.uuid4().hex[:12]}"
+        settings = {"video_id": video_id, "limit": limit, "include_replies": include_replies, "format": fmt}
+        client = YouTubeClient("bench", base_url=base_url)
+        started = time.perf_counter()
+        path = fetch_and_export(job_id, settings, client)
+        latencies.append(time.perf_counter() - started)
+        result = json.loads(r.get(f"job:{job_id}:result") or b"{}")
+        if not path or not result:
+            raise RuntimeError(f"benchmark job {job_id} failed: {r.get(f'job:{job_id}:progress')}")
+        comments += int(result.get("count", 0))
+        os.remove(path)
+        if result.get("artifact_key"):
+            r.delete(result["artifact_key"])
+        _cleanup(r, job_id, video_id)
+    total = sum(latencies)
+    return {
+        "limit": limit,
+        "format": fmt,
+        "include_replies": include_replies,
+        "runs": runs,
+        "comments": comments,
+        "comments_per_s": round(comments / total, 1) if total else 0.0,
+        "p50_s": round(percentile(latencies, 50), 4),
+        "p99_s": round(percentile(latencies, 99), 4),
+    }
+
+
+def _case_name(case: Dict) -> str:
+    return f"{case['limit']}/{case['format']}/{'replies' if case['include_replies'] else 'top'}"
+
+
+def print_report(cases: List[Dict], baseline: Optional[Dict[str, Dict]] = None) -> None:
+    header = f"{'case':<24} {'comments/s':>12} {'p50 s':>9} {'p99 s':>9}"
+    if baseline:
+        header += f" {'vs base':>9}"
+    print(header)
+    for case in cases:
+        line = f"{_case_name(case):<24} {case['comments_per_s']:>12.1f} {case['p50_s']:>9.3f} {case['p99_s']:>9.3f}"
+        base = (baseline or {}).get(_case_name(case))
+        if base and base.get("comments_per_s"):
+            change = (case["comments_per_s"] / base["comments_per_s"] - 1) * 100
+            line += f" {change:>+8.1f}%"
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark fetch_and_export against the fake YouTube API")
+    parser.add_argument("--limits", default="200,1000,5000")
+    parser.add_argument("--formats", default="csv,xlsx,json")
+    parser.add_argument("--replies", choices=["off", "on", "both"], default="both")
+    parser.add_argument("--runs", type=int, default=5, help="jobs per case")
+    parser.add_argument("--api-url", help="use an already running fake API instead of starting one")
+    parser.add_argument("--output", help="write results as JSON, e.g. to keep as a baseline")
+    parser.add_argument("--baseline", help="JSON written by --output to compare against")
+    add_options_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # fetch_and_export reads its settings from the environment
+    os.environ.setdefault("BOT_TOKEN", "bench")
+    os.environ.setdefault("YT_API_KEY", "bench")
+    export_dir = tempfile.mkdtemp(prefix="yt-bench-")
+    os.environ["EXPORT_DIR"] = export_dir
+
+    from app.config import Config
+    from app.storage.redis import get_redis_sync
+
+    r = get_redis_sync(Config.from_env().redis_url)
+    replies = {"off": [False], "on": [True], "both": [False, True]}[args.replies]
+    options = options_from_args(args)
+
+    server = None if args.api_url else FakeApiServer(options)
+    base_url = args.api_url or server.start()
+    cases: List[Dict] = []
+    try:
+        for include_replies in replies:
+            for limit in [int(v) for v in _csv(args.limits)]:
+                for fmt in _csv(args.formats):
+                    cases.append(run_case(base_url, r, limit, fmt, include_replies, args.runs))
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(export_dir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = {_case_name(c): c for c in json.load(f)["cases"]}
+    print_report(cases, baseline)
+    if server is not None:
+        print(f"fake API: {server.api.stats()}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"options": vars(options), "cases": cases}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import argparse
+from typing import Dict, List, Optional
+
+from app.bench.cache_codec import best_of, sample_comments
+from app.services import batch, filtering
+from app.storage.comment_cache import CHUNK_COMMENTS
+
+# Sorting and range filtering with and without NumPy's CommentBatch, on the fake API's synthetic
+# comments read in cache-chunk pages the way the worker reads them. Both paths must return the
+# same comments in the same order.
+
+
+def run(pages: List[List[Dict]], numpy: bool, sort: str, limit: Optional[int], **ranges) -> List[Dict]:
+    saved = batch.np
+    if not numpy:
+        batch.np = None
+    try:
+        matched = filtering.filter_pages(pages, **ranges)
+        return list(filtering.stream_filters(matched, sort=sort, limit=limit))
+    finally:
+        batch.np = saved
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark sorting with and without NumPy")
+    parser.add_argument("--comments", type=int, default=50000)
+    parser.add_argument("--limits", default="5000,20000,all")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if not batch.available():
+        raise SystemExit("NumPy is not installed")
+    comments = sample_comments(args.comments)
+    pages = [comments[i : i + CHUNK_COMMENTS] for i in range(0, len(comments), CHUNK_COMMENTS)]
+    print(f"{'sort':<12} {'limit':>6} {'filters':<8} {'python ms':>10} {'numpy ms':>9} {'speedup':>8}")
+    for sort in ("length_desc", "likes_desc", "date_new"):
+        for value in [v.strip() for v in args.limits.split(",") if v.strip()]:
+            limit = None if value == "all" else int(value)
+            for name, ranges in (("none", {}), ("ranges", {"min_len": 20, "min_likes": 1})):
+                kwargs = dict(sort=sort, limit=limit, **ranges)
+                if run(pages, False, **kwargs) != run(pages, True, **kwargs):
+                    raise RuntimeError(f"NumPy path disagrees ({sort}, limit={value}, {name})")
+                python_s = best_of(lambda: run(pages, False, **kwargs), args.repeat)
+                numpy_s = best_of(lambda: run(pages, True, **kwargs), args.repeat)
+                print(
+                    f"{sort:<12} {value:>6} {name:<8} {python_s * 1000:>10.1f} {numpy_s * 1000:>9.1f} "
+                    f"{python_s / numpy_s:>7.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
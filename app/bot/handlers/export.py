@@ -7,17 +7,36 @@ from aiogram.filters import Command
 from aiogram.types import CallbackQuery, FSInputFile, Message
 from rq import Queue
 
-from app.bot.handlers.utils import get_last_job_ts, get_user_settings, set_last_job_ts, set_user_settings
+from app.bot.handlers.utils import format_label, get_last_job_ts, get_user_settings, set_last_job_ts, set_user_settings
 from app.bot.keyboards.inline import job_keyboard, result_keyboard
-from app.storage.cache_keys import job_cancel_key, job_progress_key, job_result_key, job_status_key
+from app.storage.cache_keys import (
+    async_job_queue_key,
+    job_cancel_key,
+    job_progress_key,
+    job_result_key,
+    job_status_key,
+    yt_comments_meta_key,
+    yt_video_comments_key,
+)
+from app.storage.export_artifacts import (
+    ARTIFACT_TTL_SECONDS,
+    artifact_key,
+    manifest_version,
+    parse_artifact,
+    servable,
+)
 
 router = Router()
 
 
-def _enqueue_job(redis_sync, settings: dict) -> str:
-    q = Queue("default", connection=redis_sync)
+def _enqueue_job(redis_sync, settings: dict, backend: str = "rq", job_timeout: int = 2400) -> str:
     job_id = str(uuid4())
-    q.enqueue("app.workers.tasks.fetch_and_export", job_id, settings)
+    if backend == "async":
+        payload = json.dumps({"job_id": job_id, "settings": settings}).encode("utf-8")
+        redis_sync.rpush(async_job_queue_key(), payload)
+        return job_id
+    q = Queue("default", connection=redis_sync)
+    q.enqueue("app.workers.tasks.fetch_and_export", job_id, settings, job_timeout=job_timeout)
     return job_id
 
 
@@ -48,14 +67,80 @@ def _format_status(status: str, progress_raw: bytes | None) -> str:
             message = data.get("message", "")
             fetched = data.get("fetched", 0)
             limit = int(data.get("limit") or 0)
-            bar = _progress_bar(fetched, limit) if limit else ""
-            progress = f"\n{message} | fetched: {fetched}" + (f"\n{bar}" if bar else "")
+            if "matched" in data:
+                # filtered jobs scan past `limit`; the bar tracks matches found
+                matched = int(data.get("matched") or 0)
+                bar = _progress_bar(matched, limit) if limit else ""
+                progress = f"\n{message} | scanned: {data.get('scanned', fetched)} | matched: {matched}"
+            else:
+                bar = _progress_bar(fetched, limit) if limit else ""
+                progress = f"\n{message} | fetched: {fetched}"
+            progress += f"\n{bar}" if bar else ""
         except Exception:
             pass
     return f"Статус: {status}{progress}"
 
 
-async def _run_job(message, user_id: int, settings: dict, rate_limit_seconds: int, redis, redis_sync):
+def _result_caption(data: dict) -> str:
+    label = format_label(data.get("format", "csv"), data.get("compress"))
+    return f"✅ Готово\nСобрано: {data.get('count', 0)}\nФормат: {label}"
+
+
+async def _send_result(message, redis, data: dict, job_id: str | None = None) -> None:
+    # a file Telegram already has is sent by its file_id: no disk read and no upload
+    file_id = data.get("file_id")
+    if file_id:
+        await message.answer_document(file_id, caption=_result_caption(data))
+        return
+    sent = await message.answer_document(FSInputFile(data["file_path"]), caption=_result_caption(data))
+    if not sent.document:
+        return
+    data["file_id"] = sent.document.file_id
+    if job_id:
+        ttl = await redis.ttl(job_result_key(job_id))
+        await redis.setex(job_result_key(job_id), max(ttl, 60), json.dumps(data).encode("utf-8"))
+    art_key = data.get("artifact_key")
+    if art_key:
+        artifact = parse_artifact(await redis.get(art_key))
+        if artifact and artifact.get("file_path") == data.get("file_path"):
+            artifact["file_id"] = data["file_id"]
+            ttl = await redis.ttl(art_key)
+            await redis.setex(art_key, ttl if ttl > 0 else ARTIFACT_TTL_SECONDS, json.dumps(artifact).encode("utf-8"))
+
+
+async def _cached_result(redis, settings: dict, default_limit: int) -> dict | None:
+    # an export with these settings of the current (fresh) cache entry, if one was made
+    meta_raw = await redis.get(
+        yt_comments_meta_key(yt_video_comments_key(settings["video_id"], bool(settings.get("include_replies", False))))
+    )
+    version = manifest_version(meta_raw)
+    if version is None:
+        return None
+    art_key = artifact_key(settings, version, default_limit)
+    artifact = parse_artifact(await redis.get(art_key))
+    if not servable(artifact):
+        return None
+    return dict(artifact, artifact_key=art_key)
+
+
+async def _run_job(
+    message,
+    user_id: int,
+    settings: dict,
+    rate_limit_seconds: int,
+    redis,
+    redis_sync,
+    backend: str = "rq",
+    default_limit: int = 500,
+    job_timeout: int = 2400,
+):
+    # repeats of an export are answered right away and do not count against the rate limit
+    cached = await _cached_result(redis, settings, default_limit)
+    if cached:
+        await _send_result(message, redis, cached)
+        await message.answer("", reply_markup=result_keyboard())
+        return
+
     last_ts = await get_last_job_ts(redis, user_id)
     now = time.time()
     if now - last_ts < rate_limit_seconds:
@@ -63,7 +148,7 @@ async def _run_job(message, user_id: int, settings: dict, rate_limit_seconds: in
         return
 
     await set_last_job_ts(redis, user_id, now)
-    job_id = _enqueue_job(redis_sync, settings)
+    job_id = _enqueue_job(redis_sync, settings, backend, job_timeout)
     await redis.setex(job_status_key(job_id), 60 * 60 * 4, b"queued")
     await redis.setex(job_progress_key(job_id), 60 * 60 * 4, b"{\"message\": \"Queued\", \"fetched\": 0}")
     settings["last_job_id"] = job_id
@@ -83,7 +168,17 @@ async def run_quick(callback: CallbackQuery, redis, redis_sync, config) -> None:
         await callback.answer()
         return
     rate_limit_seconds = config.rate_limit_seconds
-    await _run_job(callback.message, callback.from_user.id, settings, rate_limit_seconds, redis, redis_sync)
+    await _run_job(
+        callback.message,
+        callback.from_user.id,
+        settings,
+        rate_limit_seconds,
+        redis,
+        redis_sync,
+        config.job_backend,
+        config.default_limit,
+        config.job_timeout,
+    )
     await callback.answer()
 
 
@@ -95,7 +190,17 @@ async def run_job_callback(callback: CallbackQuery, redis, redis_sync, config) -
         await callback.answer()
         return
     rate_limit_seconds = config.rate_limit_seconds
-    await _run_job(callback.message, callback.from_user.id, settings, rate_limit_seconds, redis, redis_sync)
+    await _run_job(
+        callback.message,
+        callback.from_user.id,
+        settings,
+        rate_limit_seconds,
+        redis,
+        redis_sync,
+        config.job_backend,
+        config.default_limit,
+        config.job_timeout,
+    )
     await callback.answer()
 
 
@@ -106,7 +211,17 @@ async def run_job_cmd(message: Message, redis, redis_sync, config) -> None:
         await message.answer("Сначала пришли ссылку на видео.")
         return
     rate_limit_seconds = config.rate_limit_seconds
-    await _run_job(message, message.from_user.id, settings, rate_limit_seconds, redis, redis_sync)
+    await _run_job(
+        message,
+        message.from_user.id,
+        settings,
+        rate_limit_seconds,
+        redis,
+        redis_sync,
+        config.job_backend,
+        config.default_limit,
+        config.job_timeout,
+    )
 
 
 @router.callback_query(F.data.startswith("job:refresh:"))
@@ -122,13 +237,8 @@ async def refresh_status(callback: CallbackQuery, redis) -> None:
         if result_raw:
             try:
                 data = json.loads(result_raw.decode("utf-8"))
-                file_path = data.get("file_path")
-                if file_path:
-                    doc = FSInputFile(file_path)
-                    await callback.message.answer_document(
-                        doc,
-                        caption=f"✅ Готово\nСобрано: {data.get('count', 0)}\nФормат: {data.get('format', 'csv').upper()}",
-                    )
+                if data.get("file_path") or data.get("file_id"):
+                    await _send_result(callback.message, redis, data, job_id)
                     await callback.message.answer("", reply_markup=result_keyboard())
             except Exception:
                 pass
@@ -160,14 +270,12 @@ async def get_file(callback: CallbackQuery, redis) -> None:
         await callback.answer()
         return
 
-    file_path = data.get("file_path")
-    if not file_path:
+    if not data.get("file_path") and not data.get("file_id"):
         await callback.message.answer("Файл не найден.")
         await callback.answer()
         return
 
-    doc = FSInputFile(file_path)
-    await callback.message.answer_document(doc, caption=f"✅ Готово\nСобрано: {data.get('count', 0)}\nФормат: {data.get('format', 'csv').upper()}")
+    await _send_result(callback.message, redis, data, job_id)
     await callback.message.answer("", reply_markup=result_keyboard())
     await callback.answer()
 
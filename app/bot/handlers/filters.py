@@ -1,8 +1,19 @@
+import re
+from datetime import datetime
+from html import escape
+
 from aiogram import F, Router
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
-from app.bot.handlers.utils import format_settings, get_user_settings, set_user_settings
+from app.bot.handlers.utils import (
+    format_label,
+    format_range,
+    format_settings,
+    get_user_settings,
+    set_user_settings,
+)
 from app.bot.keyboards.inline import (
     fields_keyboard,
     format_keyboard,
@@ -15,6 +26,7 @@ from app.bot.keyboards.inline import (
     start_keyboard,
 )
 from app.bot.states import KeywordInput, LimitInput
+from app.services.query import QueryError, compile_query, normalize_query
 
 router = Router()
 
@@ -66,11 +78,23 @@ async def link_reset(callback: CallbackQuery, redis) -> None:
     await callback.answer()
 
 
+def _format_text(settings: dict) -> str:
+    fmt = settings.get("format", "csv")
+    text = f"Формат файла\nТекущий: {format_label(fmt, settings.get('compress'))}"
+    if fmt != "xlsx":
+        text += (
+            "\nСжатие уменьшает файл в несколько раз: большие выгрузки приходят быстрее"
+            " и не упираются в лимит Telegram на размер файла."
+        )
+    return text
+
+
 @router.callback_query(F.data == "menu:format")
 async def menu_format(callback: CallbackQuery, redis) -> None:
     settings = await get_user_settings(redis, callback.from_user.id)
-    text = f"Формат файла\nТекущий: {settings.get('format', 'csv').upper()}"
-    await callback.message.edit_text(text, reply_markup=format_keyboard(settings.get("format", "csv")))
+    await callback.message.edit_text(
+        _format_text(settings), reply_markup=format_keyboard(settings.get("format", "csv"), settings.get("compress"))
+    )
     await callback.answer()
 
 
@@ -80,11 +104,22 @@ async def set_format(callback: CallbackQuery, redis) -> None:
     settings = await get_user_settings(redis, callback.from_user.id)
     settings["format"] = fmt
     await set_user_settings(redis, callback.from_user.id, settings)
-    text = f"Формат файла\nТекущий: {fmt.upper()}"
-    await callback.message.edit_text(text, reply_markup=format_keyboard(fmt))
+    await callback.message.edit_text(_format_text(settings), reply_markup=format_keyboard(fmt, settings.get("compress")))
     await callback.answer("Формат обновлен")
 
 
+@router.callback_query(F.data.startswith("compress:"))
+async def set_compress(callback: CallbackQuery, redis) -> None:
+    value = callback.data.split(":", 1)[1]
+    settings = await get_user_settings(redis, callback.from_user.id)
+    settings["compress"] = value if value in ("gzip", "zip") else None
+    await set_user_settings(redis, callback.from_user.id, settings)
+    await callback.message.edit_text(
+        _format_text(settings), reply_markup=format_keyboard(settings.get("format", "csv"), settings["compress"])
+    )
+    await callback.answer("Сжатие обновлено")
+
+
 @router.callback_query(F.data == "menu:limit")
 async def menu_limit(callback: CallbackQuery, redis) -> None:
     settings = await get_user_settings(redis, callback.from_user.id)
@@ -148,7 +183,7 @@ async def menu_keywords(callback: CallbackQuery, redis) -> None:
     settings = await get_user_settings(redis, callback.from_user.id)
     text = (
         "Фильтр по ключевым словам\n"
-        f"Сейчас: {', '.join(settings.get('keywords', [])) or 'нет'}\n"
+        f"Сейчас: {escape(', '.join(settings.get('keywords', []))) or 'нет'}\n"
         f"Режим: {'все' if settings.get('keywords_mode')=='all' else 'любое'}\n"
         f"Регистр: {'учитывать' if settings.get('keywords_case_sensitive') else 'игнорировать'}"
     )
@@ -204,6 +239,117 @@ async def keywords_input(message: Message, state: FSMContext, redis) -> None:
     await message.answer("Ключевые слова обновлены.", reply_markup=settings_keyboard())
 
 
+# escaped for the bot's HTML parse mode, as are the queries echoed back
+QUERY_HELP = escape(
+    "Фильтр-запрос: /filter <запрос>, сброс: /filter off\n\n"
+    "слово, \"фраза\" — есть в тексте\n"
+    "a b или a AND b — оба условия; a OR b — любое; NOT a или -a — исключить\n"
+    "likes>10, replies>=1, len<200 — лайки, ответы, длина текста\n"
+    "after:2024-01-01, before:2024-06-01 — дата публикации (after включительно)\n"
+    "author:имя, is:reply, is:top\n\n"
+    "Пример: (refund OR scam) AND NOT giveaway AND likes>10 AND after:2024-01-01\n"
+    "Операторы пишутся заглавными (AND/OR/NOT или И/ИЛИ/НЕ). "
+    "Регистр слов — как в настройке ключевых слов."
+)
+
+
+@router.message(Command("filter"))
+async def filter_cmd(message: Message, command: CommandObject, redis) -> None:
+    settings = await get_user_settings(redis, message.from_user.id)
+    args = normalize_query(command.args)
+    if args is None:
+        await message.answer(f"Сейчас: {escape(settings.get('query') or 'нет')}\n\n{QUERY_HELP}")
+        return
+    if args.lower() in ("off", "нет", "-"):
+        settings["query"] = None
+        await set_user_settings(redis, message.from_user.id, settings)
+        await message.answer("Фильтр-запрос снят.", reply_markup=settings_keyboard())
+        return
+    try:
+        compile_query(args)
+    except QueryError as exc:
+        await message.answer(f"Не получилось разобрать запрос: {escape(str(exc))}\n\n{QUERY_HELP}")
+        return
+    settings["query"] = args
+    await set_user_settings(redis, message.from_user.id, settings)
+    await message.answer(f"Фильтр-запрос обновлен:\n{escape(args)}", reply_markup=settings_keyboard())
+
+
+LIKES_HELP = (
+    "Лайки: /likes от [до], например /likes 10 или /likes 10 500; "
+    "без нижней границы: /likes - 500; сброс: /likes off"
+)
+DATES_HELP = (
+    "Даты: /dates с [по] в формате ГГГГ-ММ-ДД, например /dates 2024-01-01 2024-06-01 "
+    "(с — включительно, по — не включая); без начала: /dates - 2024-06-01; сброс: /dates off"
+)
+
+
+def _parse_range(args: str, parse):
+    # "low [high]", "-" for an open end; raises ValueError
+    parts = args.split()
+    if not 1 <= len(parts) <= 2:
+        raise ValueError(args)
+    low, high = [None if p == "-" else parse(p) for p in parts + ["-"] * (2 - len(parts))]
+    if low is None and high is None:
+        raise ValueError(args)
+    return low, high
+
+
+def _day(value: str) -> str:
+    # dates compare as strings against published_at, so only the zero-padded form will do
+    if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+        raise ValueError(value)
+    datetime.strptime(value, "%Y-%m-%d")
+    return value
+
+
+@router.message(Command("likes"))
+async def likes_cmd(message: Message, command: CommandObject, redis) -> None:
+    settings = await get_user_settings(redis, message.from_user.id)
+    args = (command.args or "").strip()
+    current = format_range(settings.get("min_likes"), settings.get("max_likes"))
+    if not args:
+        await message.answer(f"Сейчас: {current}\n\n{LIKES_HELP}")
+        return
+    if args.lower() in ("off", "нет"):
+        settings["min_likes"] = settings["max_likes"] = None
+        await set_user_settings(redis, message.from_user.id, settings)
+        await message.answer("Фильтр по лайкам снят.", reply_markup=settings_keyboard())
+        return
+    try:
+        low, high = _parse_range(args, int)
+    except ValueError:
+        await message.answer(f"Нужны числа.\n\n{LIKES_HELP}")
+        return
+    settings["min_likes"], settings["max_likes"] = low, high
+    await set_user_settings(redis, message.from_user.id, settings)
+    await message.answer(f"Лайки: {format_range(low, high)}", reply_markup=settings_keyboard())
+
+
+@router.message(Command("dates"))
+async def dates_cmd(message: Message, command: CommandObject, redis) -> None:
+    settings = await get_user_settings(redis, message.from_user.id)
+    args = (command.args or "").strip()
+    current = format_range(settings.get("after"), settings.get("before"))
+    if not args:
+        await message.answer(f"Сейчас: {current}\n\n{DATES_HELP}")
+        return
+    if args.lower() in ("off", "нет"):
+        settings["after"] = settings["before"] = None
+        await set_user_settings(redis, message.from_user.id, settings)
+        await message.answer("Фильтр по датам снят.", reply_markup=settings_keyboard())
+        return
+    try:
+        after, before = _parse_range(args, _day)
+    except ValueError:
+        await message.answer(f"Нужны даты в формате ГГГГ-ММ-ДД.\n\n{DATES_HELP}")
+        return
+    settings["after"], settings["before"] = after, before
+    await set_user_settings(redis, message.from_user.id, settings)
+    await message.answer(f"Даты: {format_range(after, before)}", reply_markup=settings_keyboard())
+
+
 @router.callback_query(F.data == "menu:replies")
 async def menu_replies(callback: CallbackQuery, redis) -> None:
     settings = await get_user_settings(redis, callback.from_user.id)
@@ -249,11 +395,17 @@ async def reset_settings(callback: CallbackQuery, redis) -> None:
     settings.update(
         {
             "format": "csv",
+            "compress": None,
             "sort": "none",
             "keywords": [],
             "keywords_mode": "any",
             "keywords_case_sensitive": False,
             "min_len": None,
+            "query": None,
+            "min_likes": None,
+            "max_likes": None,
+            "after": None,
+            "before": None,
             "limit": 500,
             "include_replies": False,
             "fields": ["author", "published_at", "like_count", "text"],
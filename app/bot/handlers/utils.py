@@ -1,17 +1,25 @@
 import json
 import time
-from typing import Any, Dict
+from html import escape
+from typing import Any, Dict, Optional
 
+from app.services.export import output_compression
 from app.storage.cache_keys import user_job_key, user_last_job_time_key
 
 DEFAULT_SETTINGS = {
     "video_id": None,
     "format": "csv",
+    "compress": None,
     "sort": "none",
     "keywords": [],
     "keywords_mode": "any",
     "keywords_case_sensitive": False,
     "min_len": None,
+    "query": None,
+    "min_likes": None,
+    "max_likes": None,
+    "after": None,
+    "before": None,
     "limit": 500,
     "include_replies": False,
     "fields": ["author", "published_at", "like_count", "text"],
@@ -50,8 +58,25 @@ async def get_last_job_ts(r, tg_id: int) -> float:
         return 0.0
 
 
+def format_label(fmt: str, compress: Optional[str] = None) -> str:
+    compress = output_compression(fmt, compress)
+    return f"{fmt.upper()} ({compress})" if compress else fmt.upper()
+
+
+def format_range(low: Any, high: Any) -> str:
+    if low is None and high is None:
+        return "—"
+    parts = []
+    if low is not None:
+        parts.append(f"от {low}")
+    if high is not None:
+        parts.append(f"до {high}")
+    return " ".join(parts)
+
+
 def format_settings(settings: Dict[str, Any]) -> str:
-    keywords = ", ".join(settings.get("keywords", [])) or "—"
+    # the bot sends HTML: user-typed keywords and queries are escaped
+    keywords = escape(", ".join(settings.get("keywords", []))) or "—"
     sort = settings.get("sort", "none")
     sort_label = {
         "none": "без сортировки",
@@ -64,10 +89,13 @@ def format_settings(settings: Dict[str, Any]) -> str:
     fields = ", ".join(settings.get("fields", [])) or "—"
     return (
         "Текущие настройки:\n"
-        f"- Формат: {settings.get('format', 'csv')}\n"
+        f"- Формат: {format_label(settings.get('format', 'csv'), settings.get('compress'))}\n"
         f"- Лимит: {settings.get('limit', 500)}\n"
         f"- Сортировка: {sort_label}\n"
         f"- Ключевые слова: {keywords}\n"
+        f"- Запрос: {escape(settings.get('query') or '—')}\n"
+        f"- Лайки: {format_range(settings.get('min_likes'), settings.get('max_likes'))}\n"
+        f"- Даты: {format_range(settings.get('after'), settings.get('before'))}\n"
         f"- Replies: {'да' if settings.get('include_replies') else 'нет'}\n"
         f"- Поля: {fields}"
     )
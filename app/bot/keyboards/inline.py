@@ -34,13 +34,20 @@ def settings_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
-def format_keyboard(current: str) -> InlineKeyboardMarkup:
+def format_keyboard(current: str, compress: str | None = None) -> InlineKeyboardMarkup:
     kb = [
         [InlineKeyboardButton(text=("✅ CSV" if current == "csv" else "CSV"), callback_data="fmt:csv")],
         [InlineKeyboardButton(text=("✅ XLSX" if current == "xlsx" else "XLSX"), callback_data="fmt:xlsx")],
         [InlineKeyboardButton(text=("✅ JSON" if current == "json" else "JSON"), callback_data="fmt:json")],
-        [InlineKeyboardButton(text="↩️ Назад", callback_data="menu:settings")],
+        [InlineKeyboardButton(text=("✅ NDJSON" if current == "ndjson" else "NDJSON"), callback_data="fmt:ndjson")],
     ]
+    if current != "xlsx":
+        row = []
+        for key, label in (("none", "Без сжатия"), ("gzip", "gzip"), ("zip", "zip")):
+            checked = (compress or "none") == key
+            row.append(InlineKeyboardButton(text=("✅ " + label) if checked else label, callback_data=f"compress:{key}"))
+        kb.append(row)
+    kb.append([InlineKeyboardButton(text="↩️ Назад", callback_data="menu:settings")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
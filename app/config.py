@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 from dataclasses import dataclass
+from typing import Tuple
 from dotenv import load_dotenv
 
 _ROOT = Path(__file__).resolve().parents[1]
@@ -11,33 +12,83 @@ load_dotenv(dotenv_path=_ROOT / ".env")
 class Config:
     bot_token: str
     yt_api_key: str
+    yt_api_keys: Tuple[str, ...]
+    yt_base_url: str
     redis_url: str
     redis_fsm_db: int
     export_dir: str
     rate_limit_seconds: int
     default_limit: int
+    reply_workers: int
+    job_backend: str
+    async_job_concurrency: int
+    quota_units_per_day: int
+    quota_burst: int
+    quota_max_wait: int
+    job_timeout: int
+    decoded_cache_mb: int
+    cache_budget_mb: int
+    cache_admit_mb: int
+    filter_scan_limit: int
+    comment_index: bool
 
     @classmethod
     def from_env(cls) -> "Config":
         bot_token = os.getenv("BOT_TOKEN", "").strip()
         yt_api_key = os.getenv("YT_API_KEY", "").strip()
+        yt_api_keys = tuple(k.strip() for k in os.getenv("YT_API_KEYS", "").split(",") if k.strip())
+        if not yt_api_key and yt_api_keys:
+            yt_api_key = yt_api_keys[0]
+        if yt_api_key and yt_api_key not in yt_api_keys:
+            yt_api_keys = (yt_api_key,) + yt_api_keys
+        yt_base_url = os.getenv("YT_BASE_URL", "https://www.googleapis.com/youtube/v3").strip()
         redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0").strip()
         redis_fsm_db = int(os.getenv("REDIS_FSM_DB", "1"))
         export_dir = os.getenv("EXPORT_DIR", str(_ROOT / "exports")).strip()
         rate_limit_seconds = int(os.getenv("RATE_LIMIT_SECONDS", "120"))
         default_limit = int(os.getenv("DEFAULT_LIMIT", "200"))
+        reply_workers = int(os.getenv("REPLY_WORKERS", "8"))
+        job_backend = os.getenv("JOB_BACKEND", "rq").strip().lower()
+        async_job_concurrency = int(os.getenv("ASYNC_JOB_CONCURRENCY", "16"))
+        quota_units_per_day = int(os.getenv("YT_QUOTA_UNITS_PER_DAY", "10000"))
+        # per key; by default a quarter of the daily units, so a busy hour runs at full speed
+        # and only sustained use is paced to the daily rate
+        quota_burst = int(os.getenv("YT_QUOTA_BURST", "").strip() or quota_units_per_day // 4)
+        quota_max_wait = int(os.getenv("YT_QUOTA_MAX_WAIT", "600"))
+        # RQ kills jobs running past their timeout; a throttled job also sits out up to
+        # YT_QUOTA_MAX_WAIT seconds of quota waits in total
+        job_timeout = int(os.getenv("JOB_TIMEOUT", "1800")) + quota_max_wait
+        decoded_cache_mb = int(os.getenv("DECODED_CACHE_MB", "64"))
+        cache_budget_mb = int(os.getenv("CACHE_BUDGET_MB", "48"))
+        cache_admit_mb = int(os.getenv("CACHE_ADMIT_MB", "4"))
+        filter_scan_limit = int(os.getenv("FILTER_SCAN_LIMIT", "10000"))
+        comment_index = os.getenv("COMMENT_INDEX", "1").strip().lower() not in ("0", "false", "no", "off")
 
         if not bot_token:
             raise RuntimeError("BOT_TOKEN is required")
         if not yt_api_key:
-            raise RuntimeError("YT_API_KEY is required")
+            raise RuntimeError("YT_API_KEY or YT_API_KEYS is required")
 
         return cls(
             bot_token=bot_token,
             yt_api_key=yt_api_key,
+            yt_api_keys=yt_api_keys,
+            yt_base_url=yt_base_url,
             redis_url=redis_url,
             redis_fsm_db=redis_fsm_db,
             export_dir=export_dir,
             rate_limit_seconds=rate_limit_seconds,
             default_limit=default_limit,
+            reply_workers=reply_workers,
+            job_backend=job_backend,
+            async_job_concurrency=async_job_concurrency,
+            quota_units_per_day=quota_units_per_day,
+            quota_burst=quota_burst,
+            quota_max_wait=quota_max_wait,
+            job_timeout=job_timeout,
+            decoded_cache_mb=decoded_cache_mb,
+            cache_budget_mb=cache_budget_mb,
+            cache_admit_mb=cache_admit_mb,
+            filter_scan_limit=filter_scan_limit,
+            comment_index=comment_index,
         )
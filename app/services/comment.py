@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import sys
+from collections.abc import Mapping
+from operator import attrgetter
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# One normalized comment. A job holds up to hundreds of thousands of them at a time, and an
+# eight-key dict is close to three times the size of these eight slots, so the fetchers and the
+# cache decoder build Comments. A Comment reads like the dicts it replaces (get, [], keys,
+# values, ==), so filters and exporters take either. video_id and parent_id are interned: every
+# comment of a video, and every reply of a thread, shares one string.
+
+FIELDS = (
+    "comment_id",
+    "parent_id",
+    "author",
+    "published_at",
+    "like_count",
+    "text",
+    "reply_count",
+    "video_id",
+)
+_KEYS = frozenset(FIELDS)
+_values = attrgetter(*FIELDS)
+_intern = sys.intern
+
+
+class Comment(Mapping):
+    __slots__ = FIELDS
+
+    def __init__(
+        self,
+        comment_id: Optional[str] = None,
+        parent_id: Optional[str] = None,
+        author: Optional[str] = None,
+        published_at: Optional[str] = None,
+        like_count: Any = 0,
+        text: str = "",
+        reply_count: Any = 0,
+        video_id: Optional[str] = None,
+    ):
+        self.comment_id = comment_id
+        self.parent_id = parent_id if parent_id is None else _intern(parent_id)
+        self.author = author
+        self.published_at = published_at
+        self.like_count = like_count
+        self.text = text
+        self.reply_count = reply_count
+        self.video_id = video_id if video_id is None else _intern(video_id)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Comment":
+        return cls(*(data.get(k) for k in FIELDS))
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in _KEYS else default
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(FIELDS)
+
+    def __len__(self) -> int:
+        return len(FIELDS)
+
+    def __contains__(self, key: object) -> bool:
+        return key in _KEYS
+
+    def values(self) -> Tuple:  # type: ignore[override]
+        # a tuple in FIELDS order rather than a view: one C call for the cache encoder
+        return _values(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(zip(FIELDS, _values(self)))
+
+    def __repr__(self) -> str:
+        return f"Comment({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return Comment, _values(self)
+
+
+# Field readers for code that runs once per comment (filters, sort keys, query conditions,
+# NumPy columns). A Comment's slots are read directly, as its get() is a Python-level call that
+# doubles the cost of a cheap condition; other mappings (rows of an old cache format) go
+# through get(). Missing values read as "" or 0.
+
+
+def text_of(c: Mapping) -> str:
+    return (c.text if type(c) is Comment else c.get("text")) or ""
+
+
+def likes_of(c: Mapping) -> int:
+    return int((c.like_count if type(c) is Comment else c.get("like_count")) or 0)
+
+
+def replies_of(c: Mapping) -> int:
+    return int((c.reply_count if type(c) is Comment else c.get("reply_count")) or 0)
+
+
+def published_of(c: Mapping) -> str:
+    return (c.published_at if type(c) is Comment else c.get("published_at")) or ""
+
+
+def author_of(c: Mapping) -> str:
+    return (c.author if type(c) is Comment else c.get("author")) or ""
+
+
+def parent_of(c: Mapping) -> Optional[str]:
+    return c.parent_id if type(c) is Comment else c.get("parent_id")
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import csv
+import gzip
+import io
+import json
 import os
+import shutil
+import zipfile
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List
+from typing import Iterable, Iterator, List, Optional, TextIO
+from uuid import uuid4
 
 from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
 
 FIELDS = [
     "author",
@@ -18,19 +24,59 @@ FIELDS = [
     "parent_id",
     "video_id",
 ]
+MAX_COLUMN_WIDTH = 80
+XML_BLOCK_BYTES = 1 << 16
+FORMATS = ("csv", "xlsx", "json", "ndjson")
+# text formats can be written compressed; an XLSX file is a deflated zip already
+COMPRESSIONS = {"gzip": "gz", "zip": "zip"}
+GZIP_LEVEL = 6
 
 
 def build_filename(video_id: str, ext: str) -> str:
     ts = datetime.utcnow().strftime("%Y%m%d_%H%M")
-    return f"comments_{video_id}_{ts}.{ext}"
+    # exported files are reused for repeat requests, so two exports in the same minute must not
+    # overwrite each other
+    return f"comments_{video_id}_{ts}_{uuid4().hex[:6]}.{ext}"
 
 
-def export_csv(comments: List[dict], export_dir: str, video_id: str, fields: List[str]) -> str:
-    os.makedirs(export_dir, exist_ok=True)
-    filename = build_filename(video_id, "csv")
-    path = os.path.join(export_dir, filename)
+def output_compression(fmt: str, compress: Optional[str]) -> Optional[str]:
+    # the compression an export with these settings is written with
+    if fmt == "xlsx" or compress not in COMPRESSIONS:
+        return None
+    return compress
 
-    with open(path, "w", newline="", encoding="utf-8") as f:
+
+def _output_path(export_dir: str, video_id: str, ext: str, compress: Optional[str]) -> str:
+    os.makedirs(export_dir, exist_ok=True)
+    filename = build_filename(video_id, ext)
+    if compress:
+        filename = f"{filename}.{COMPRESSIONS[compress]}"
+    return os.path.join(export_dir, filename)
+
+
+@contextmanager
+def _open_text(path: str, compress: Optional[str]) -> Iterator[TextIO]:
+    # rows are compressed as they are written, so compressed exports stream like plain ones
+    if compress == "gzip":
+        with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=GZIP_LEVEL) as f:
+            yield f
+    elif compress == "zip":
+        # one file inside, named like the uncompressed export
+        member = os.path.basename(path)[: -len(".zip")]
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(member, "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+                yield f
+    else:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            yield f
+
+
+def export_csv(
+    comments: Iterable[dict], export_dir: str, video_id: str, fields: List[str], compress: Optional[str] = None
+) -> str:
+    path = _output_path(export_dir, video_id, "csv", compress)
+
+    with _open_text(path, compress) as f:
         writer = csv.DictWriter(f, fieldnames=fields)
         writer.writeheader()
         for c in comments:
@@ -39,39 +85,104 @@ def export_csv(comments: List[dict], export_dir: str, video_id: str, fields: Lis
     return path
 
 
-def export_xlsx(comments: List[dict], export_dir: str, video_id: str, fields: List[str]) -> str:
+def _insert_before(path: str, marker: bytes, insert: bytes) -> None:
+    # streams `path` through a copy with `insert` placed before the first `marker`
+    tmp = f"{path}.tmp"
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        tail = b""
+        while True:
+            block = src.read(XML_BLOCK_BYTES)
+            data = tail + block
+            at = data.find(marker)
+            if at >= 0:
+                dst.write(data[:at] + insert + data[at:])
+                shutil.copyfileobj(src, dst)
+                break
+            if not block:
+                dst.write(data)
+                break
+            keep = len(marker) - 1
+            dst.write(data[:-keep])
+            tail = data[-keep:]
+    os.replace(tmp, path)
+
+
+def export_xlsx(comments: Iterable[dict], export_dir: str, video_id: str, fields: List[str]) -> str:
     os.makedirs(export_dir, exist_ok=True)
     filename = build_filename(video_id, "xlsx")
     path = os.path.join(export_dir, filename)
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Comments"
+    # write-only: rows go straight to the sheet's XML in a temporary file instead of staying in
+    # memory as cells, and column widths are tracked as they are written
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Comments")
 
+    widths = [len(name) for name in fields]
     ws.append(fields)
     for c in comments:
-        ws.append([c.get(k, "") for k in fields])
-
-    for col_idx, col_name in enumerate(fields, start=1):
-        max_len = len(col_name)
-        for row in ws.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx):
-            val = row[0].value
-            if val is None:
-                continue
-            max_len = max(max_len, len(str(val)))
-        ws.column_dimensions[get_column_letter(col_idx)].width = min(max_len + 2, 80)
+        row = [c.get(k, "") for k in fields]
+        for i, value in enumerate(row):
+            if value is not None:
+                width = len(value) if type(value) is str else len(str(value))
+                if width > widths[i]:
+                    widths[i] = width
+        ws.append(row)
+
+    # a write-only sheet writes <cols> ahead of its rows, before any width is known, so the
+    # element is added to the finished sheet XML (ws._writer.out, openpyxl 3.1) before saving
+    ws.close()
+    if widths:
+        cols = "".join(
+            f'<col width="{min(width + 2, MAX_COLUMN_WIDTH)}" customWidth="1" min="{i}" max="{i}" />'
+            for i, width in enumerate(widths, start=1)
+        )
+        _insert_before(ws._writer.out, b"<sheetData", f"<cols>{cols}</cols>".encode("utf-8"))
 
     wb.save(path)
     return path
 
 
-def export_json(comments: List[dict], export_dir: str, video_id: str, fields: List[str]) -> str:
-    os.makedirs(export_dir, exist_ok=True)
-    filename = build_filename(video_id, "json")
-    path = os.path.join(export_dir, filename)
-    payload = [{k: c.get(k, "") for k in fields} for c in comments]
-    with open(path, "w", encoding="utf-8") as f:
-        import json
+def export_json(
+    comments: Iterable[dict], export_dir: str, video_id: str, fields: List[str], compress: Optional[str] = None
+) -> str:
+    path = _output_path(export_dir, video_id, "json", compress)
+    # written row by row; the output matches json.dump(rows, indent=2)
+    with _open_text(path, compress) as f:
+        first = True
+        for c in comments:
+            row = json.dumps({k: c.get(k, "") for k in fields}, ensure_ascii=False, indent=2)
+            f.write("[\n" if first else ",\n")
+            f.write("  " + row.replace("\n", "\n  "))
+            first = False
+        f.write("[]" if first else "\n]")
+    return path
+
 
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+def export_ndjson(
+    comments: Iterable[dict], export_dir: str, video_id: str, fields: List[str], compress: Optional[str] = None
+) -> str:
+    # one JSON object per line, without the indentation that makes up much of a JSON export
+    path = _output_path(export_dir, video_id, "ndjson", compress)
+    with _open_text(path, compress) as f:
+        for c in comments:
+            f.write(json.dumps({k: c.get(k, "") for k in fields}, ensure_ascii=False))
+            f.write("\n")
     return path
+
+
+def export_comments(
+    fmt: str,
+    comments: Iterable[dict],
+    export_dir: str,
+    video_id: str,
+    fields: List[str],
+    compress: Optional[str] = None,
+) -> str:
+    compress = output_compression(fmt, compress)
+    if fmt == "xlsx":
+        return export_xlsx(comments, export_dir, video_id, fields)
+    if fmt == "json":
+        return export_json(comments, export_dir, video_id, fields, compress)
+    if fmt == "ndjson":
+        return export_ndjson(comments, export_dir, video_id, fields, compress)
+    return export_csv(comments, export_dir, video_id, fields, compress)
@@ -1,4 +1,169 @@
-from typing import Iterable, List, Optional
+import heapq
+from itertools import chain, islice
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.services import batch
+from app.services.comment import likes_of, published_of, text_of
+from app.services.keywords import compile_keywords
+from app.services.query import compile_query
+
+
+def _length(c: dict) -> int:
+    return len(text_of(c))
+
+
+SORT_KEYS: Dict[str, Callable[[dict], object]] = {
+    "length_desc": _length,
+    "length_asc": _length,
+    "likes_desc": likes_of,
+    "date_new": published_of,
+    "date_old": published_of,
+}
+SORT_REVERSED = {"length_desc", "likes_desc", "date_new"}
+# top_comments keeps a heap up to this limit and a sorted buffer above it
+TOP_HEAP_MAX = 4096
+
+
+def filter_comments(
+    comments: Iterable[dict],
+    keywords: Optional[List[str]] = None,
+    keywords_mode: str = "any",
+    keywords_case_sensitive: bool = False,
+    min_len: Optional[int] = None,
+    query: Optional[str] = None,
+    min_likes: Optional[int] = None,
+    max_likes: Optional[int] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+) -> Iterator[dict]:
+    items: Iterable[dict] = comments
+
+    if min_len is not None:
+        items = (c for c in items if len(text_of(c)) >= min_len)
+    # like counts and publish dates compare like the query's likes>= / after: / before:
+    if min_likes is not None:
+        items = (c for c in items if likes_of(c) >= min_likes)
+    if max_likes is not None:
+        items = (c for c in items if likes_of(c) <= max_likes)
+    if after is not None:
+        items = (c for c in items if published_of(c) >= after)
+    if before is not None:
+        items = (c for c in items if published_of(c) < before)
+
+    match = compile_keywords(keywords, keywords_mode, keywords_case_sensitive)
+    if match is not None:
+        items = (c for c in items if match(text_of(c)))
+
+    predicate = compile_query(query, keywords_case_sensitive)
+    if predicate is not None:
+        items = (c for c in items if predicate(c))
+
+    return iter(items)
+
+
+def filter_pages(
+    pages: Iterable[List[dict]],
+    keywords: Optional[List[str]] = None,
+    keywords_mode: str = "any",
+    keywords_case_sensitive: bool = False,
+    min_len: Optional[int] = None,
+    query: Optional[str] = None,
+    min_likes: Optional[int] = None,
+    max_likes: Optional[int] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+) -> Iterator[dict]:
+    # filter_comments over a stream of pages (the worker's fetched pages and cache chunks), read
+    # one page at a time. With NumPy the like-count range is one array mask per page of
+    # BATCH_PAGE_ROWS or more; text lengths and ISO dates cost about as much to load into arrays
+    # as to compare in Python, so they and the text filters run on the rows the mask keeps.
+    if not batch.available() or (min_likes is None and max_likes is None):
+        return filter_comments(
+            chain.from_iterable(pages),
+            keywords,
+            keywords_mode,
+            keywords_case_sensitive,
+            min_len,
+            query,
+            min_likes,
+            max_likes,
+            after,
+            before,
+        )
+
+    def _liked() -> Iterator[List[dict]]:
+        for page in pages:
+            if len(page) >= batch.BATCH_PAGE_ROWS:
+                rows = batch.CommentBatch(page)
+                yield rows.rows(rows.matching(min_likes=min_likes, max_likes=max_likes))
+            else:
+                yield list(filter_comments(page, min_likes=min_likes, max_likes=max_likes))
+
+    return filter_comments(
+        chain.from_iterable(_liked()),
+        keywords,
+        keywords_mode,
+        keywords_case_sensitive,
+        min_len,
+        query,
+        after=after,
+        before=before,
+    )
+
+
+def sort_comments(items: List[dict], sort: str = "none") -> List[dict]:
+    key = SORT_KEYS.get(sort)
+    if key is not None:
+        items.sort(key=key, reverse=sort in SORT_REVERSED)
+    return items
+
+
+def top_comments(items: Iterable[dict], sort: str, limit: int) -> List[dict]:
+    # the first `limit` of sort_comments(list(items), sort), holding O(limit) items at a time so
+    # `items` can be a stream. Small limits keep a heap (nlargest/nsmallest break ties by arrival,
+    # like the stable sort); larger ones sort a buffer of kept and new items and cut it back,
+    # which stays ahead of the heap once `limit` is a good part of the input. With NumPy the
+    # buffer is sorted by a CommentBatch argsort instead, in steps of at least BATCH_ROWS.
+    key = SORT_KEYS.get(sort)
+    if limit <= 0:
+        return []
+    if key is None:
+        return list(islice(items, limit))
+    reverse = sort in SORT_REVERSED
+    if limit <= TOP_HEAP_MAX:
+        return (heapq.nlargest if reverse else heapq.nsmallest)(limit, items, key=key)
+    if batch.sortable(sort):
+        return _top_batched(items, sort, limit)
+    it = iter(items)
+    kept: List[Tuple[object, dict]] = []
+    while True:
+        chunk = list(islice(it, limit))
+        if not chunk:
+            break
+        # kept items precede the new ones, so equal keys keep their arrival order
+        kept.extend(zip(map(key, chunk), chunk))
+        kept.sort(key=itemgetter(0), reverse=reverse)
+        del kept[limit:]
+    return [c for _, c in kept]
+
+
+def _top_batched(items: Iterable[dict], sort: str, limit: int) -> List[dict]:
+    it = iter(items)
+    step = max(limit, batch.BATCH_ROWS)
+    kept: List[dict] = []
+    while True:
+        chunk = list(islice(it, step))
+        if not chunk:
+            break
+        kept.extend(chunk)
+        if len(kept) < batch.BATCH_MIN_ROWS:
+            sort_comments(kept, sort)
+            del kept[limit:]
+            continue
+        rows = batch.CommentBatch(kept)
+        kept = rows.rows(rows.order(sort)[:limit])
+    return kept
 
 
 def apply_filters(
@@ -9,49 +174,50 @@ def apply_filters(
     min_len: Optional[int] = None,
     sort: str = "none",
     limit: Optional[int] = None,
+    query: Optional[str] = None,
+    min_likes: Optional[int] = None,
+    max_likes: Optional[int] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
 ) -> List[dict]:
-    items = list(comments)
+    return list(
+        stream_filters(
+            comments,
+            keywords,
+            keywords_mode,
+            keywords_case_sensitive,
+            min_len,
+            sort,
+            limit,
+            query,
+            min_likes,
+            max_likes,
+            after,
+            before,
+        )
+    )
 
-    if min_len is not None:
-        items = [c for c in items if len(c.get("text", "")) >= min_len]
-
-    if keywords:
-        if keywords_case_sensitive:
-            kw = [k for k in keywords if k.strip()]
-        else:
-            kw = [k.lower() for k in keywords if k.strip()]
-        if kw:
-            if keywords_mode == "all":
-                items = [
-                    c
-                    for c in items
-                    if all(
-                        k in (c.get("text", "") if keywords_case_sensitive else c.get("text", "").lower())
-                        for k in kw
-                    )
-                ]
-            else:
-                items = [
-                    c
-                    for c in items
-                    if any(
-                        k in (c.get("text", "") if keywords_case_sensitive else c.get("text", "").lower())
-                        for k in kw
-                    )
-                ]
-
-    if sort == "length_desc":
-        items.sort(key=lambda c: len(c.get("text", "")), reverse=True)
-    elif sort == "length_asc":
-        items.sort(key=lambda c: len(c.get("text", "")))
-    elif sort == "likes_desc":
-        items.sort(key=lambda c: int(c.get("like_count", 0)), reverse=True)
-    elif sort == "date_new":
-        items.sort(key=lambda c: c.get("published_at", ""), reverse=True)
-    elif sort == "date_old":
-        items.sort(key=lambda c: c.get("published_at", ""))
-
-    if limit is not None:
-        items = items[:limit]
 
-    return items
+def stream_filters(
+    comments: Iterable[dict],
+    keywords: Optional[List[str]] = None,
+    keywords_mode: str = "any",
+    keywords_case_sensitive: bool = False,
+    min_len: Optional[int] = None,
+    sort: str = "none",
+    limit: Optional[int] = None,
+    query: Optional[str] = None,
+    min_likes: Optional[int] = None,
+    max_likes: Optional[int] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+) -> Iterator[dict]:
+    # Unsorted results flow straight through; sorted ones need every match first, so they are
+    # buffered (the best `limit` of them when limited). apply_filters is this as a list.
+    matched = filter_comments(
+        comments, keywords, keywords_mode, keywords_case_sensitive, min_len, query, min_likes, max_likes, after, before
+    )
+    if sort not in SORT_KEYS:
+        yield from (matched if limit is None else islice(matched, limit))
+        return
+    yield from (sort_comments(list(matched), sort) if limit is None else top_comments(matched, sort, limit))
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Sequence, Tuple
+
+from app.services.youtube import QuotaExceededError
+from app.storage.cache_keys import yt_key_retired_key, yt_key_used_key
+
+logger = logging.getLogger(__name__)
+
+try:
+    from zoneinfo import ZoneInfo
+
+    _QUOTA_TZ = ZoneInfo("America/Los_Angeles")
+except Exception:  # tzdata missing in the image
+    _QUOTA_TZ = timezone(timedelta(hours=-8))
+
+
+class NoApiKeyAvailable(QuotaExceededError):
+    pass
+
+
+def key_fingerprint(api_key: str) -> str:
+    # keys never appear in Redis key names
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def quota_day(now: Optional[datetime] = None) -> Tuple[str, int]:
+    # YouTube resets quota at midnight Pacific time; returns the day label and seconds until reset
+    now = (now or datetime.now(timezone.utc)).astimezone(_QUOTA_TZ)
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return now.strftime("%Y%m%d"), max(int((tomorrow - now).total_seconds()), 1)
+
+
+def _pick(keys: Sequence[str], units_per_key: int, raw: List) -> Optional[str]:
+    n = len(keys)
+    best = None
+    best_remaining = 0
+    for i, api_key in enumerate(keys):
+        used, retired = raw[i], raw[n + i]
+        if retired:
+            continue
+        remaining = units_per_key - int(used or 0)
+        if remaining > best_remaining:
+            best, best_remaining = api_key, remaining
+    return best
+
+
+class ApiKeyPool:
+    def __init__(self, redis, keys: Sequence[str], units_per_key: int):
+        if not keys:
+            raise ValueError("ApiKeyPool needs at least one key")
+        self.redis = redis
+        self.keys = list(dict.fromkeys(keys))
+        self.units_per_key = units_per_key
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _names(self, day: str) -> List[str]:
+        fps = [key_fingerprint(k) for k in self.keys]
+        return [yt_key_used_key(fp, day) for fp in fps] + [yt_key_retired_key(fp, day) for fp in fps]
+
+    def choose(self) -> str:
+        day, _ = quota_day()
+        best = _pick(self.keys, self.units_per_key, self.redis.mget(self._names(day)))
+        if best is None:
+            raise NoApiKeyAvailable("All YouTube API keys are out of quota for today")
+        return best
+
+    def charge(self, api_key: str, units: int) -> None:
+        day, ttl = quota_day()
+        name = yt_key_used_key(key_fingerprint(api_key), day)
+        pipe = self.redis.pipeline()
+        pipe.incrby(name, units)
+        pipe.expire(name, ttl + 3600)
+        pipe.execute()
+
+    def retire(self, api_key: str) -> None:
+        day, ttl = quota_day()
+        logger.warning("API key %s retired until quota reset", key_fingerprint(api_key))
+        self.redis.setex(yt_key_retired_key(key_fingerprint(api_key), day), ttl + 3600, b"1")
+
+
+class AsyncApiKeyPool:
+    def __init__(self, redis, keys: Sequence[str], units_per_key: int):
+        if not keys:
+            raise ValueError("AsyncApiKeyPool needs at least one key")
+        self.redis = redis
+        self.keys = list(dict.fromkeys(keys))
+        self.units_per_key = units_per_key
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _names(self, day: str) -> List[str]:
+        fps = [key_fingerprint(k) for k in self.keys]
+        return [yt_key_used_key(fp, day) for fp in fps] + [yt_key_retired_key(fp, day) for fp in fps]
+
+    async def choose(self) -> str:
+        day, _ = quota_day()
+        best = _pick(self.keys, self.units_per_key, await self.redis.mget(self._names(day)))
+        if best is None:
+            raise NoApiKeyAvailable("All YouTube API keys are out of quota for today")
+        return best
+
+    async def charge(self, api_key: str, units: int) -> None:
+        day, ttl = quota_day()
+        name = yt_key_used_key(key_fingerprint(api_key), day)
+        pipe = self.redis.pipeline()
+        pipe.incrby(name, units)
+        pipe.expire(name, ttl + 3600)
+        await pipe.execute()
+
+    async def retire(self, api_key: str) -> None:
+        day, ttl = quota_day()
+        logger.warning("API key %s retired until quota reset", key_fingerprint(api_key))
+        await self.redis.setex(yt_key_retired_key(key_fingerprint(api_key), day), ttl + 3600, b"1")
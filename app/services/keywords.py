@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import re
+from typing import Callable, Dict, List, Optional
+
+# Keyword filters are compiled once per job, and each text is casefolded once however many
+# keywords there are. Per-keyword substring checks run at C speed and stop at the first hit
+# (`any`) or miss (`all`); from TRIE_MIN_KEYWORDS keywords on, `any` is one pass of a regex
+# spelling out the keywords' trie (`refund|refuse` -> `refu(?:nd|se)`), so shared prefixes are
+# walked once, as in Aho–Corasick. CPython's regex engine backtracks rather than running a DFA,
+# so for short lists the plain checks win (python -m app.bench.keywords).
+TRIE_MIN_KEYWORDS = 96
+
+
+def _trie_pattern(words: List[str]) -> str:
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+def _prune(words: List[str], mode: str) -> List[str]:
+    # for `any`, a keyword containing another one can never decide a match; for `all`, one
+    # contained in another is implied by it
+    if mode == "all":
+        return [w for w in words if not any(w != o and w in o for o in words)]
+    return [w for w in words if not any(w != o and o in w for o in words)]
+
+
+def compile_keywords(
+    keywords: Optional[List[str]],
+    mode: str = "any",
+    case_sensitive: bool = False,
+) -> Optional[Callable[[str], bool]]:
+    # a predicate on comment text, or None when there is nothing to match
+    fold = None if case_sensitive else str.casefold
+    words = {k if fold is None else fold(k) for k in keywords or [] if k.strip()}
+    if not words:
+        return None
+    words = _prune(sorted(words), mode)
+
+    if mode == "all":
+        # longest first: the more specific keywords tend to end the check soonest
+        words.sort(key=len, reverse=True)
+
+        def match_all(text: str) -> bool:
+            if fold is not None:
+                text = fold(text)
+            for word in words:
+                if word not in text:
+                    return False
+            return True
+
+        return match_all
+
+    if len(words) >= TRIE_MIN_KEYWORDS:
+        search = re.compile(_trie_pattern(words)).search
+
+        def match_trie(text: str) -> bool:
+            return search(text if fold is None else fold(text)) is not None
+
+        return match_trie
+
+    # shortest first: the more general keywords tend to hit soonest
+    words.sort(key=len)
+
+    def match_any(text: str) -> bool:
+        if fold is not None:
+            text = fold(text)
+        for word in words:
+            if word in text:
+                return True
+        return False
+
+    return match_any
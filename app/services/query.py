@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import operator
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from app.services.comment import author_of, likes_of, parent_of, published_of, replies_of, text_of
+from app.services.keywords import compile_keywords
+
+# Filter queries such as `(refund OR scam) AND NOT giveaway AND likes>10 AND after:2024-01-01`.
+#
+#   words, "quoted phrases"      substring of the text
+#   a b, a AND b, a OR b         AND binds tighter than OR; adjacent conditions are ANDed
+#   NOT a, -a                    negation
+#   likes, replies, len          compared with > >= < <= = != (`:` means =)
+#   after:YYYY-MM-DD             published on that day or later
+#   before:YYYY-MM-DD            published before that day
+#   author:name, author:"a b"    substring of the author name
+#   is:reply, is:top
+#
+# A query is compiled into one predicate. Conditions joined by AND / OR are reordered
+# cheapest first (numbers and dates, then the author, then text), plain words under one
+# AND / OR become a single keyword matcher, and the text is casefolded once per comment, only
+# after the cheap top-level conditions have passed.
+
+OPERATORS = {"AND": "AND", "И": "AND", "OR": "OR", "ИЛИ": "OR", "NOT": "NOT", "НЕ": "NOT"}
+
+_COMPARE = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+    ":": operator.eq,
+    "!=": operator.ne,
+}
+
+_NUMBERS = {
+    "likes": likes_of,
+    "replies": replies_of,
+    "len": lambda c: len(text_of(c)),
+}
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+    (?P<lparen>\() | (?P<rparen>\)) |
+    (?P<number>likes|replies|len)\s*(?P<op>>=|<=|!=|>|<|=|:)\s*(?P<value>-?\d+)(?![^\s()]) |
+    (?P<date>after|before):(?P<day>\d{4}-\d{2}-\d{2})(?![^\s()]) |
+    is:(?P<kind>reply|top)(?![^\s()]) |
+    author:(?:"(?P<author_phrase>[^"]*)"|(?P<author>[^\s()"]+)) |
+    (?P<neg>-)(?=[^\s()]) |
+    "(?P<phrase>[^"]*)" |
+    (?P<word>[^\s()"]+)
+    )""",
+    re.VERBOSE | re.IGNORECASE,
+)
+
+# cost classes, cheapest first
+FIELD_COST = 1
+AUTHOR_COST = 2
+TEXT_COST = 3
+
+
+class QueryError(ValueError):
+    pass
+
+
+@dataclass
+class _Pred:
+    fn: Callable[[dict, str], bool]
+    cost: int
+    uses_text: bool
+    # set on AND nodes, so the top level can run the cheap conditions before casefolding the text
+    parts: Optional[List["_Pred"]] = None
+    # set on plain text terms, which AND / OR merge into one keyword matcher
+    term: Optional[str] = None
+
+
+def normalize_query(query: Optional[str]) -> Optional[str]:
+    query = " ".join((query or "").split())
+    return query or None
+
+
+def _tokenize(query: str) -> List[Tuple[str, object]]:
+    tokens: List[Tuple[str, object]] = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        m = _TOKEN.match(query, pos)
+        if m is None or m.end() == pos:
+            raise QueryError(f"Не понял запрос около «{query[pos:pos + 20].strip()}»")
+        pos = m.end()
+        if m.group("lparen"):
+            tokens.append(("(", None))
+        elif m.group("rparen"):
+            tokens.append((")", None))
+        elif m.group("number"):
+            tokens.append(("number", (m.group("number").lower(), m.group("op"), int(m.group("value")))))
+        elif m.group("date"):
+            day = m.group("day")
+            try:
+                datetime.strptime(day, "%Y-%m-%d")
+            except ValueError:
+                raise QueryError(f"Неверная дата: {day}") from None
+            tokens.append(("date", (m.group("date").lower(), day)))
+        elif m.group("kind"):
+            tokens.append(("is", m.group("kind").lower()))
+        elif m.group("author_phrase") is not None:
+            tokens.append(("author", m.group("author_phrase")))
+        elif m.group("author"):
+            tokens.append(("author", m.group("author")))
+        elif m.group("neg"):
+            tokens.append(("NOT", None))
+        elif m.group("phrase") is not None:
+            tokens.append(("term", m.group("phrase")))
+        else:
+            word = m.group("word")
+            op = OPERATORS.get(word)
+            tokens.append((op, None) if op else ("term", word))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: List[Tuple[str, object]], fold: Optional[Callable[[str], str]]):
+        self.tokens = tokens
+        self.pos = 0
+        self.fold = fold
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def parse(self) -> _Pred:
+        pred = self.parse_or()
+        if self.peek() == ")":
+            raise QueryError("Лишняя закрывающая скобка")
+        if self.peek() is not None:
+            raise QueryError("Не понял запрос")
+        return pred
+
+    def parse_or(self) -> _Pred:
+        parts = [self.parse_and()]
+        while self.peek() == "OR":
+            self.pos += 1
+            parts.append(self.parse_and())
+        return parts[0] if len(parts) == 1 else _any_of(parts)
+
+    def parse_and(self) -> _Pred:
+        parts = [self.parse_not()]
+        while self.peek() not in (None, ")", "OR"):
+            if self.peek() == "AND":
+                self.pos += 1
+            parts.append(self.parse_not())
+        return parts[0] if len(parts) == 1 else _all_of(parts)
+
+    def parse_not(self) -> _Pred:
+        if self.peek() == "NOT":
+            self.pos += 1
+            inner = self.parse_not()
+            return _Pred(lambda c, t: not inner.fn(c, t), inner.cost, inner.uses_text)
+        return self.parse_atom()
+
+    def parse_atom(self) -> _Pred:
+        kind = self.peek()
+        if kind is None:
+            raise QueryError("Запрос оборвался: не хватает условия")
+        if kind in ("AND", "OR", ")"):
+            raise QueryError(f"Ожидалось условие, а не «{kind}»")
+        value = self.tokens[self.pos][1]
+        self.pos += 1
+        if kind == "(":
+            pred = self.parse_or()
+            if self.peek() != ")":
+                raise QueryError("Не хватает закрывающей скобки")
+            self.pos += 1
+            return pred
+        if kind == "number":
+            name, op, number = value
+            get, compare = _NUMBERS[name], _COMPARE[op]
+            return _Pred(lambda c, t: compare(get(c), number), FIELD_COST, False)
+        if kind == "date":
+            which, day = value
+            if which == "after":
+                return _Pred(lambda c, t: published_of(c) >= day, FIELD_COST, False)
+            return _Pred(lambda c, t: published_of(c) < day, FIELD_COST, False)
+        if kind == "is":
+            want_reply = value == "reply"
+            return _Pred(lambda c, t: (parent_of(c) is not None) == want_reply, FIELD_COST, False)
+        if kind == "author":
+            fold = self.fold
+            name = value if fold is None else fold(value)
+            if fold is None:
+                return _Pred(lambda c, t: name in author_of(c), AUTHOR_COST, False)
+            return _Pred(lambda c, t: name in fold(author_of(c)), AUTHOR_COST, False)
+        word = value if self.fold is None else self.fold(value)
+        if not word.strip():
+            raise QueryError("Пустая фраза в кавычках")
+        return _Pred(lambda c, t: word in t, TEXT_COST, True, term=word)
+
+
+def _merge_terms(parts: List[_Pred], mode: str) -> List[_Pred]:
+    # plain words under one AND / OR become one keyword matcher over the folded text
+    terms = [p.term for p in parts if p.term is not None]
+    if len(terms) < 2:
+        return parts
+    match = compile_keywords(terms, mode, case_sensitive=True)
+    merged = _Pred(lambda c, t: match(t), TEXT_COST, True)
+    return [p for p in parts if p.term is None] + [merged]
+
+
+def _all_of(parts: List[_Pred]) -> _Pred:
+    flat: List[_Pred] = []
+    for p in parts:
+        flat.extend(p.parts if p.parts is not None else [p])
+    flat = sorted(_merge_terms(flat, "all"), key=lambda p: p.cost)
+    fns = [p.fn for p in flat]
+
+    def fn(c: dict, t: str) -> bool:
+        for f in fns:
+            if not f(c, t):
+                return False
+        return True
+
+    return _Pred(fn, sum(p.cost for p in flat), any(p.uses_text for p in flat), parts=flat)
+
+
+def _any_of(parts: List[_Pred]) -> _Pred:
+    flat = sorted(_merge_terms(parts, "any"), key=lambda p: p.cost)
+    fns = [p.fn for p in flat]
+
+    def fn(c: dict, t: str) -> bool:
+        for f in fns:
+            if f(c, t):
+                return True
+        return False
+
+    return _Pred(fn, sum(p.cost for p in flat), any(p.uses_text for p in flat))
+
+
+def compile_query(query: Optional[str], case_sensitive: bool = False) -> Optional[Callable[[dict], bool]]:
+    # a predicate on comments, or None for an empty query; raises QueryError for a bad one
+    query = normalize_query(query)
+    if query is None:
+        return None
+    fold = None if case_sensitive else str.casefold
+    root = _Parser(_tokenize(query), fold).parse()
+
+    if not root.uses_text:
+        fn = root.fn
+        return lambda c: fn(c, "")
+
+    parts = root.parts if root.parts is not None else [root]
+    before = [p.fn for p in parts if not p.uses_text]
+    after = [p.fn for p in parts if p.uses_text]
+
+    def match(c: dict) -> bool:
+        for f in before:
+            if not f(c, ""):
+                return False
+        text = text_of(c)
+        if fold is not None:
+            text = fold(text)
+        for f in after:
+            if not f(c, text):
+                return False
+        return True
+
+    return match
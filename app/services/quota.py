@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import logging
+import time
+from typing import Optional
+
+from app.services.youtube import YouTubeAPIError, endpoint_cost
+from app.storage.cache_keys import yt_quota_bucket_key
+
+logger = logging.getLogger(__name__)
+
+BUCKET_TTL_SECONDS = 60 * 60 * 48
+MAX_SLEEP_SECONDS = 5.0
+
+# Token bucket shared by every worker. Uses the Redis clock so workers with skewed clocks agree.
+# Returns "0" when the tokens were taken, otherwise the seconds until `cost` tokens are available.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], ttl)
+return tostring(wait)
+"""
+
+_EXHAUST_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('HSET', KEYS[1], 'tokens', '0', 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+return 1
+"""
+
+
+class QuotaWaitTimeout(YouTubeAPIError):
+    pass
+
+
+class QuotaScheduler:
+    def __init__(
+        self,
+        redis,
+        units_per_day: int,
+        burst: int,
+        max_wait: float = 600.0,
+        key: Optional[str] = None,
+    ):
+        self.redis = redis
+        self.capacity = max(burst, 1)
+        self.rate = units_per_day / 86400.0
+        self.max_wait = max_wait
+        # seconds this scheduler has spent waiting for tokens: max_wait bounds a job's total
+        # wait, so each job gets its own scheduler (or for_job() view) of the shared bucket
+        self.waited = 0.0
+        self.key = key or yt_quota_bucket_key()
+        self._take = redis.register_script(_TAKE_SCRIPT)
+        self._exhaust = redis.register_script(_EXHAUST_SCRIPT)
+
+    def try_acquire(self, cost: int) -> float:
+        raw = self._take(keys=[self.key], args=[self.capacity, self.rate, cost, BUCKET_TTL_SECONDS])
+        return float(raw)
+
+    def acquire(self, endpoint: str) -> None:
+        cost = endpoint_cost(endpoint)
+        while True:
+            wait = self.try_acquire(cost)
+            if wait <= 0:
+                return
+            if self.waited + wait > self.max_wait:
+                raise QuotaWaitTimeout(f"YouTube quota: job already waited {self.waited:.0f}s of {self.max_wait:.0f}s")
+            logger.info("Quota bucket empty, waiting %.1fs for %s", wait, endpoint)
+            pause = min(wait, MAX_SLEEP_SECONDS)
+            time.sleep(pause)
+            self.waited += pause
+
+    def exhaust(self) -> None:
+        self._exhaust(keys=[self.key], args=[BUCKET_TTL_SECONDS])
+
+
+class AsyncQuotaScheduler:
+    def __init__(
+        self,
+        redis,
+        units_per_day: int,
+        burst: int,
+        max_wait: float = 600.0,
+        key: Optional[str] = None,
+    ):
+        self.redis = redis
+        self.capacity = max(burst, 1)
+        self.rate = units_per_day / 86400.0
+        self.max_wait = max_wait
+        # seconds this scheduler has spent waiting for tokens: max_wait bounds a job's total
+        # wait, so each job gets its own scheduler (or for_job() view) of the shared bucket
+        self.waited = 0.0
+        self.key = key or yt_quota_bucket_key()
+        self._take = redis.register_script(_TAKE_SCRIPT)
+        self._exhaust = redis.register_script(_EXHAUST_SCRIPT)
+
+    def for_job(self) -> "AsyncQuotaScheduler":
+        # the same bucket with a fresh wait budget, for one job on a worker's shared client
+        job = copy.copy(self)
+        job.waited = 0.0
+        return job
+
+    async def try_acquire(self, cost: int) -> float:
+        raw = await self._take(keys=[self.key], args=[self.capacity, self.rate, cost, BUCKET_TTL_SECONDS])
+        return float(raw)
+
+    async def acquire(self, endpoint: str) -> None:
+        cost = endpoint_cost(endpoint)
+        while True:
+            wait = await self.try_acquire(cost)
+            if wait <= 0:
+                return
+            if self.waited + wait > self.max_wait:
+                raise QuotaWaitTimeout(f"YouTube quota: job already waited {self.waited:.0f}s of {self.max_wait:.0f}s")
+            logger.info("Quota bucket empty, waiting %.1fs for %s", wait, endpoint)
+            pause = min(wait, MAX_SLEEP_SECONDS)
+            await asyncio.sleep(pause)
+            self.waited += pause
+
+    async def exhaust(self) -> None:
+        await self._exhaust(keys=[self.key], args=[BUCKET_TTL_SECONDS])
@@ -1,44 +1,293 @@
 from __future__ import annotations
 
+import json
 import logging
-from typing import Dict, Iterator, List, Optional
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from app.services.comment import Comment
 
 BASE_URL = "https://www.googleapis.com/youtube/v3"
 
+POOL_MAXSIZE = 16
+
+# YouTube Data API v3 list calls used by the client; anything unknown is charged as a list call
+QUOTA_COSTS = {
+    "commentThreads": 1,
+    "comments": 1,
+}
+DEFAULT_COST = 1
+
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "backendError"}
+
+# snippet keys read by _normalize_comment; used to build the partial-response masks. A
+# comment's reply count lives on its thread's snippet, not the comment's, so only the thread
+# mask asks for it (an unknown selector fails the whole request with 400 invalidParameter).
+COMMENT_SNIPPET_FIELDS = [
+    "authorDisplayName",
+    "publishedAt",
+    "likeCount",
+    "textDisplay",
+    "textOriginal",
+]
+
+_COMMENT_MASK = f"id,snippet({','.join(COMMENT_SNIPPET_FIELDS)})"
+_THREAD_SNIPPET_MASK = f"snippet(totalReplyCount,topLevelComment({_COMMENT_MASK}))"
+THREADS_FIELDS = f"nextPageToken,items({_THREAD_SNIPPET_MASK})"
+THREADS_WITH_REPLIES_FIELDS = f"nextPageToken,items({_THREAD_SNIPPET_MASK},replies(comments({_COMMENT_MASK})))"
+REPLIES_FIELDS = f"nextPageToken,items({_COMMENT_MASK})"
+
 logger = logging.getLogger(__name__)
 
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+
+
+def get_session() -> requests.Session:
+    # one keep-alive pool per process; recreated after fork so workers never share sockets
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(
+            {
+                "Accept-Encoding": "gzip",
+                "User-Agent": "simple-parser-youtube (gzip)",
+            }
+        )
+        _session = session
+        _session_pid = pid
+    return _session
+
 
 class YouTubeAPIError(RuntimeError):
     pass
 
 
+class QuotaExceededError(YouTubeAPIError):
+    pass
+
+
+class FetchCancelled(RuntimeError):
+    def __init__(self) -> None:
+        super().__init__("cancelled")
+
+
+def endpoint_cost(endpoint: str) -> int:
+    return QUOTA_COSTS.get(endpoint, DEFAULT_COST)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    # full jitter keeps workers that failed together from retrying together
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_CAP_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def is_retryable(status: int, reason: Optional[str]) -> bool:
+    return status in RETRY_STATUSES or reason in RETRY_REASONS
+
+
+def error_reason(body: str) -> Optional[str]:
+    try:
+        errors = json.loads(body).get("error", {}).get("errors") or []
+    except (ValueError, AttributeError):
+        return None
+    return errors[0].get("reason") if errors else None
+
+
+def normalize_comment(item: Dict, video_id: str, parent_id: Optional[str], reply_count: int = 0) -> Comment:
+    snippet = item.get("snippet", {})
+    return Comment(
+        comment_id=item.get("id"),
+        parent_id=parent_id,
+        author=snippet.get("authorDisplayName"),
+        published_at=snippet.get("publishedAt"),
+        like_count=snippet.get("likeCount", 0),
+        text=snippet.get("textDisplay") or snippet.get("textOriginal") or "",
+        reply_count=reply_count,
+        video_id=video_id,
+    )
+
+
+def threads_params(video_id: str, include_replies: bool) -> Dict:
+    return {
+        "part": "snippet,replies" if include_replies else "snippet",
+        "videoId": video_id,
+        "maxResults": 100,
+        "textFormat": "plainText",
+        "order": "time",
+        "fields": THREADS_WITH_REPLIES_FIELDS if include_replies else THREADS_FIELDS,
+    }
+
+
+def replies_params(parent_id: str) -> Dict:
+    return {
+        "part": "snippet",
+        "parentId": parent_id,
+        "maxResults": 100,
+        "textFormat": "plainText",
+        "fields": REPLIES_FIELDS,
+    }
+
+
+@dataclass
+class FetchCursor:
+    # position in a video's commentThreads listing: the page being read (None = first page),
+    # how many of its threads were fully emitted, and how many items of the next one were
+    page_token: Optional[str] = None
+    thread_index: int = 0
+    thread_items: int = 0
+    exhausted: bool = False
+
+    def advance(self, next_page_token: Optional[str]) -> None:
+        self.page_token = next_page_token
+        self.thread_index = 0
+        self.thread_items = 0
+        self.exhausted = not next_page_token
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> "FetchCursor":
+        return cls(**data) if data else cls()
+
+
+def thread_comments(
+    thread: Dict,
+    video_id: str,
+    include_replies: bool,
+    fetch_replies: Callable[[str], Iterable[Dict]],
+) -> Iterator[Dict]:
+    # normalized comments of one thread in output order: top comment, inlined replies, then
+    # (when the thread has more) every reply page
+    snippet = thread.get("snippet", {})
+    top_comment = snippet.get("topLevelComment", {})
+    if not top_comment:
+        return
+    top_id = top_comment.get("id")
+    reply_count = snippet.get("totalReplyCount", 0)
+    yield normalize_comment(top_comment, video_id, None, reply_count)
+    if not include_replies:
+        return
+    replies = thread.get("replies", {}).get("comments", [])
+    for reply in replies:
+        yield normalize_comment(reply, video_id, top_id)
+    if reply_count and len(replies) < reply_count:
+        for reply in fetch_replies(top_id):
+            yield normalize_comment(reply, video_id, top_id)
+
+
+def cut_at_known(items: List[Dict], video_id: str, stop_before: Callable[[Dict], bool]) -> Tuple[List[Dict], bool]:
+    # order=time pages run newest first, so everything from the first known thread on is cached
+    for i, thread in enumerate(items):
+        top_comment = thread.get("snippet", {}).get("topLevelComment", {})
+        if top_comment and stop_before(normalize_comment(top_comment, video_id, None)):
+            return items[:i], True
+    return items, False
+
+
+def plan_reply_fetches(items: List[Dict], budget: int) -> List[str]:
+    # threads whose extra reply pages can still land inside the limit, estimated from totalReplyCount
+    planned: List[str] = []
+    expected = 0
+    for thread in items:
+        if expected >= budget:
+            break
+        snippet = thread.get("snippet", {})
+        top_id = snippet.get("topLevelComment", {}).get("id")
+        if not top_id:
+            continue
+        inline = thread.get("replies", {}).get("comments", [])
+        reply_count = snippet.get("totalReplyCount", 0)
+        expected += 1 + len(inline)
+        if reply_count and len(inline) < reply_count and expected < budget:
+            planned.append(top_id)
+            expected += reply_count
+    return planned
+
+
 class YouTubeClient:
-    def __init__(self, api_key: str, timeout: int = 20):
+    def __init__(
+        self,
+        api_key: str,
+        timeout: int = 20,
+        session: Optional[requests.Session] = None,
+        quota=None,
+        key_pool=None,
+        base_url: Optional[str] = None,
+    ):
         self.api_key = api_key
         self.timeout = timeout
+        self.base_url = (base_url or BASE_URL).rstrip("/")
+        self.session = session or get_session()
+        self.quota = quota
+        self.key_pool = key_pool
 
     def _request(self, endpoint: str, params: Dict) -> Dict:
-        url = f"{BASE_URL}/{endpoint}"
-        params = {**params, "key": self.api_key}
-        resp = requests.get(url, params=params, timeout=self.timeout)
-        if resp.status_code != 200:
+        url = f"{self.base_url}/{endpoint}"
+        attempt = 0
+        while True:
+            try:
+                api_key = self.key_pool.choose() if self.key_pool else self.api_key
+            except QuotaExceededError:
+                # every key in the pool is retired for today
+                if self.quota:
+                    self.quota.exhaust()
+                raise
+            if self.quota:
+                self.quota.acquire(endpoint)
+            try:
+                resp = self.session.get(url, params={**params, "key": api_key}, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt >= MAX_RETRIES:
+                    raise YouTubeAPIError(f"YouTube API unreachable: {exc}") from exc
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            if self.key_pool:
+                self.key_pool.charge(api_key, endpoint_cost(endpoint))
+            if resp.status_code == 200:
+                return resp.json()
+
+            reason = error_reason(resp.text)
+            if resp.status_code == 403 and reason == "quotaExceeded":
+                if self.key_pool:
+                    # retire this key and carry on with the next one; not a retry attempt
+                    self.key_pool.retire(api_key)
+                    continue
+                if self.quota:
+                    self.quota.exhaust()
+                raise QuotaExceededError(f"YouTube API quota exceeded: {resp.text}")
+            if is_retryable(resp.status_code, reason) and attempt < MAX_RETRIES:
+                delay = backoff_delay(attempt, resp.headers.get("Retry-After"))
+                logger.info("YouTube API %s (%s), retrying in %.1fs", resp.status_code, reason, delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
             raise YouTubeAPIError(f"YouTube API error {resp.status_code}: {resp.text}")
-        return resp.json()
 
-    def _normalize_comment(self, item: Dict, video_id: str, parent_id: Optional[str]) -> Dict:
-        snippet = item.get("snippet", {})
-        return {
-            "comment_id": item.get("id"),
-            "parent_id": parent_id,
-            "author": snippet.get("authorDisplayName"),
-            "published_at": snippet.get("publishedAt"),
-            "like_count": snippet.get("likeCount", 0),
-            "text": snippet.get("textDisplay") or snippet.get("textOriginal") or "",
-            "reply_count": snippet.get("totalReplyCount", 0),
-            "video_id": video_id,
-        }
+    def _normalize_comment(self, item: Dict, video_id: str, parent_id: Optional[str]) -> Comment:
+        return normalize_comment(item, video_id, parent_id)
 
     def fetch_comments(
         self,
@@ -46,69 +295,138 @@ class YouTubeClient:
         limit: int = 500,
         include_replies: bool = False,
         progress_cb=None,
+        reply_workers: int = 1,
+        should_stop: Optional[Callable[[], bool]] = None,
+        stop_before: Optional[Callable[[Dict], bool]] = None,
+        cursor: Optional[FetchCursor] = None,
     ) -> List[Dict]:
-        params = {
-            "part": "snippet,replies" if include_replies else "snippet",
-            "videoId": video_id,
-            "maxResults": 100,
-            "textFormat": "plainText",
-            "order": "time",
-        }
         collected: List[Dict] = []
-        page_token = None
+        for page in self.iter_comment_pages(
+            video_id,
+            limit=limit,
+            include_replies=include_replies,
+            progress_cb=progress_cb,
+            reply_workers=reply_workers,
+            should_stop=should_stop,
+            stop_before=stop_before,
+            cursor=cursor,
+        ):
+            collected.extend(page)
+        return collected
 
-        while True:
-            if page_token:
-                params["pageToken"] = page_token
-            elif "pageToken" in params:
-                params.pop("pageToken")
+    def iter_comment_pages(
+        self,
+        video_id: str,
+        limit: int = 500,
+        include_replies: bool = False,
+        progress_cb=None,
+        reply_workers: int = 1,
+        should_stop: Optional[Callable[[], bool]] = None,
+        stop_before: Optional[Callable[[Dict], bool]] = None,
+        cursor: Optional[FetchCursor] = None,
+    ) -> Iterator[List[Dict]]:
+        # yields normalized comments one commentThreads page at a time, at most `limit` overall.
+        # `cursor` is resumed from and kept pointing just past the last yielded comment.
+        params = threads_params(video_id, include_replies)
+        cursor = cursor if cursor is not None else FetchCursor()
+        fetched = 0
+        page_token = cursor.page_token
+        if cursor.exhausted or limit <= 0:
+            return
 
-            data = self._request("commentThreads", params)
-            items = data.get("items", [])
+        executor = None
+        if include_replies and reply_workers > 1:
+            executor = ThreadPoolExecutor(max_workers=min(reply_workers, POOL_MAXSIZE))
+        stop = threading.Event()
 
-            for thread in items:
-                top_comment = thread.get("snippet", {}).get("topLevelComment", {})
-                if not top_comment:
-                    continue
+        def _check_stop() -> None:
+            if should_stop and should_stop():
+                raise FetchCancelled()
 
-                top_id = top_comment.get("id")
-                collected.append(self._normalize_comment(top_comment, video_id, None))
-                if len(collected) >= limit:
-                    return collected[:limit]
-
-                if include_replies:
-                    replies = thread.get("replies", {}).get("comments", [])
-                    for reply in replies:
-                        collected.append(self._normalize_comment(reply, video_id, top_id))
-                        if len(collected) >= limit:
-                            return collected[:limit]
-
-                    reply_count = thread.get("snippet", {}).get("totalReplyCount", 0)
-                    if reply_count and len(replies) < reply_count:
-                        for reply in self._fetch_replies(top_id):
-                            collected.append(self._normalize_comment(reply, video_id, top_id))
-                            if len(collected) >= limit:
-                                return collected[:limit]
-
-            if progress_cb:
-                try:
-                    progress_cb(len(collected))
-                except Exception:
-                    pass
+        try:
+            while True:
+                _check_stop()
+                if page_token:
+                    params["pageToken"] = page_token
+                elif "pageToken" in params:
+                    params.pop("pageToken")
 
-            page_token = data.get("nextPageToken")
-            if not page_token:
-                break
+                data = self._request("commentThreads", params)
+                items = data.get("items", [])
+                page: List[Dict] = []
+                reached_known = False
+                if stop_before:
+                    items, reached_known = cut_at_known(items, video_id, stop_before)
+                skip_threads, skip_items = cursor.thread_index, cursor.thread_items
+
+                prefetched: Dict[str, Future] = {}
+                if executor:
+                    prefetched = self._prefetch_replies(
+                        executor, items[skip_threads:], limit - fetched + skip_items, stop
+                    )
+
+                def _replies(top_id: str) -> Iterable[Dict]:
+                    future = prefetched.get(top_id)
+                    if future is None:
+                        return self._fetch_replies(top_id)
+                    if not future.done():
+                        _check_stop()
+                    return future.result()
+
+                for index in range(skip_threads, len(items)):
+                    skip = skip_items if index == skip_threads else 0
+                    for n, comment in enumerate(thread_comments(items[index], video_id, include_replies, _replies)):
+                        if n < skip:
+                            continue
+                        page.append(comment)
+                        cursor.thread_index, cursor.thread_items = index, n + 1
+                        if fetched + len(page) >= limit:
+                            yield page
+                            return
+                    cursor.thread_index, cursor.thread_items = index + 1, 0
+
+                fetched += len(page)
+                if progress_cb:
+                    try:
+                        progress_cb(fetched)
+                    except Exception:
+                        pass
 
+                page_token = data.get("nextPageToken")
+                if not reached_known:
+                    cursor.advance(page_token)
+                if page:
+                    yield page
+
+                if reached_known or not page_token:
+                    break
+        finally:
+            stop.set()
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def _prefetch_replies(
+        self,
+        executor: ThreadPoolExecutor,
+        items: List[Dict],
+        budget: int,
+        stop: threading.Event,
+    ) -> Dict[str, Future]:
+        return {
+            top_id: executor.submit(self._collect_replies, top_id, stop)
+            for top_id in plan_reply_fetches(items, budget)
+        }
+
+    def _collect_replies(self, parent_id: str, stop: threading.Event) -> List[Dict]:
+        collected: List[Dict] = []
+        for reply in self._fetch_replies(parent_id):
+            if stop.is_set():
+                break
+            collected.append(reply)
         return collected
 
     def _fetch_replies(self, parent_id: str) -> Iterator[Dict]:
-        params = {
-            "part": "snippet",
-            "parentId": parent_id,
-            "maxResults": 100,
-            "textFormat": "plainText",
-        }
+        params = replies_params(parent_id)
         page_token = None
         while True:
             if page_token:
@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import aiohttp
+
+from app.services import youtube
+from app.services.youtube import (
+    MAX_RETRIES,
+    POOL_MAXSIZE,
+    FetchCancelled,
+    FetchCursor,
+    QuotaExceededError,
+    YouTubeAPIError,
+    backoff_delay,
+    cut_at_known,
+    endpoint_cost,
+    error_reason,
+    is_retryable,
+    normalize_comment,
+    plan_reply_fetches,
+    replies_params,
+    threads_params,
+)
+
+logger = logging.getLogger(__name__)
+
+# progress/cancel callbacks get their own threads: the job threads waiting on the loop must
+# never be the ones the loop needs to finish a fetch
+_CALLBACK_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="yt-callbacks")
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def _thread_comments(
+    thread: Dict,
+    video_id: str,
+    include_replies: bool,
+    fetch_replies: Callable[[str], AsyncIterator[Dict]],
+) -> AsyncIterator[Dict]:
+    # async counterpart of youtube.thread_comments
+    snippet = thread.get("snippet", {})
+    top_comment = snippet.get("topLevelComment", {})
+    if not top_comment:
+        return
+    top_id = top_comment.get("id")
+    reply_count = snippet.get("totalReplyCount", 0)
+    yield normalize_comment(top_comment, video_id, None, reply_count)
+    if not include_replies:
+        return
+    replies = thread.get("replies", {}).get("comments", [])
+    for reply in replies:
+        yield normalize_comment(reply, video_id, top_id)
+    if reply_count and len(replies) < reply_count:
+        async for reply in fetch_replies(top_id):
+            yield normalize_comment(reply, video_id, top_id)
+
+
+class AsyncYouTubeClient:
+    def __init__(
+        self,
+        api_key: str,
+        timeout: int = 20,
+        session: Optional[aiohttp.ClientSession] = None,
+        quota=None,
+        key_pool=None,
+        base_url: Optional[str] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = (base_url or youtube.BASE_URL).rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session = session
+        self._owns_session = session is None
+        self.quota = quota
+        self.key_pool = key_pool
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=POOL_MAXSIZE * 4, limit_per_host=POOL_MAXSIZE * 4)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Accept-Encoding": "gzip", "User-Agent": "simple-parser-youtube (gzip)"},
+            )
+            self._owns_session = True
+        return self._session
+
+    def for_job(self) -> "AsyncYouTubeClient":
+        # one job's view of a worker's client: the same session and key pool, but its own quota
+        # wait budget
+        job = copy.copy(self)
+        job._session = self._get_session()
+        job._owns_session = False
+        if self.quota is not None:
+            job.quota = self.quota.for_job()
+        return job
+
+    async def close(self) -> None:
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self) -> "AsyncYouTubeClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def _request(self, endpoint: str, params: Dict) -> Dict:
+        url = f"{self.base_url}/{endpoint}"
+        query = {k: str(v) for k, v in params.items()}
+        attempt = 0
+        while True:
+            try:
+                api_key = await self.key_pool.choose() if self.key_pool else self.api_key
+            except QuotaExceededError:
+                if self.quota:
+                    await self.quota.exhaust()
+                raise
+            if self.quota:
+                await self.quota.acquire(endpoint)
+            try:
+                async with self._get_session().get(
+                    url, params={**query, "key": api_key}, timeout=self.timeout
+                ) as resp:
+                    status = resp.status
+                    retry_after = resp.headers.get("Retry-After")
+                    if status == 200:
+                        data = await resp.json(content_type=None)
+                    else:
+                        text = await resp.text()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                if attempt >= MAX_RETRIES:
+                    raise YouTubeAPIError(f"YouTube API unreachable: {exc}") from exc
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            if self.key_pool:
+                await self.key_pool.charge(api_key, endpoint_cost(endpoint))
+            if status == 200:
+                return data
+
+            reason = error_reason(text)
+            if status == 403 and reason == "quotaExceeded":
+                if self.key_pool:
+                    await self.key_pool.retire(api_key)
+                    continue
+                if self.quota:
+                    await self.quota.exhaust()
+                raise QuotaExceededError(f"YouTube API quota exceeded: {text}")
+            if is_retryable(status, reason) and attempt < MAX_RETRIES:
+                delay = backoff_delay(attempt, retry_after)
+                logger.info("YouTube API %s (%s), retrying in %.1fs", status, reason, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            raise YouTubeAPIError(f"YouTube API error {status}: {text}")
+
+    async def fetch_comments(
+        self,
+        video_id: str,
+        limit: int = 500,
+        include_replies: bool = False,
+        progress_cb=None,
+        reply_workers: int = 1,
+        should_stop: Optional[Callable] = None,
+        stop_before: Optional[Callable[[Dict], bool]] = None,
+        cursor: Optional[FetchCursor] = None,
+    ) -> List[Dict]:
+        collected: List[Dict] = []
+        async for page in self.iter_comment_pages(
+            video_id,
+            limit=limit,
+            include_replies=include_replies,
+            progress_cb=progress_cb,
+            reply_workers=reply_workers,
+            should_stop=should_stop,
+            stop_before=stop_before,
+            cursor=cursor,
+        ):
+            collected.extend(page)
+        return collected
+
+    async def iter_comment_pages(
+        self,
+        video_id: str,
+        limit: int = 500,
+        include_replies: bool = False,
+        progress_cb=None,
+        reply_workers: int = 1,
+        should_stop: Optional[Callable] = None,
+        stop_before: Optional[Callable[[Dict], bool]] = None,
+        cursor: Optional[FetchCursor] = None,
+    ) -> AsyncIterator[List[Dict]]:
+        params = threads_params(video_id, include_replies)
+        cursor = cursor if cursor is not None else FetchCursor()
+        fetched = 0
+        page_token = cursor.page_token
+        if cursor.exhausted or limit <= 0:
+            return
+        semaphore = asyncio.Semaphore(max(reply_workers, 1))
+        pending: List[asyncio.Task] = []
+
+        async def _check_stop() -> None:
+            if should_stop and await _maybe_await(should_stop()):
+                raise FetchCancelled()
+
+        try:
+            while True:
+                await _check_stop()
+                if page_token:
+                    params["pageToken"] = page_token
+                elif "pageToken" in params:
+                    params.pop("pageToken")
+
+                data = await self._request("commentThreads", params)
+                items = data.get("items", [])
+                page: List[Dict] = []
+                reached_known = False
+                if stop_before:
+                    items, reached_known = cut_at_known(items, video_id, stop_before)
+                skip_threads, skip_items = cursor.thread_index, cursor.thread_items
+
+                prefetched: Dict[str, asyncio.Task] = {}
+                if include_replies and reply_workers > 1:
+                    budget = limit - fetched + skip_items
+                    for top_id in plan_reply_fetches(items[skip_threads:], budget):
+                        prefetched[top_id] = asyncio.create_task(self._collect_replies(top_id, semaphore))
+                    pending = list(prefetched.values())
+
+                async def _replies(top_id: str) -> AsyncIterator[Dict]:
+                    task = prefetched.get(top_id)
+                    if task is None:
+                        async for reply in self._fetch_replies(top_id):
+                            yield reply
+                        return
+                    if not task.done():
+                        await _check_stop()
+                    for reply in await task:
+                        yield reply
+
+                for index in range(skip_threads, len(items)):
+                    skip = skip_items if index == skip_threads else 0
+                    n = 0
+                    async for comment in _thread_comments(items[index], video_id, include_replies, _replies):
+                        n += 1
+                        if n <= skip:
+                            continue
+                        page.append(comment)
+                        cursor.thread_index, cursor.thread_items = index, n
+                        if fetched + len(page) >= limit:
+                            yield page
+                            return
+                    cursor.thread_index, cursor.thread_items = index + 1, 0
+
+                fetched += len(page)
+                if progress_cb:
+                    try:
+                        await _maybe_await(progress_cb(fetched))
+                    except Exception:
+                        pass
+
+                page_token = data.get("nextPageToken")
+                if not reached_known:
+                    cursor.advance(page_token)
+                if page:
+                    yield page
+
+                if reached_known or not page_token:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _collect_replies(self, parent_id: str, semaphore: asyncio.Semaphore) -> List[Dict]:
+        async with semaphore:
+            return [reply async for reply in self._fetch_replies(parent_id)]
+
+    async def _fetch_replies(self, parent_id: str) -> AsyncIterator[Dict]:
+        params = replies_params(parent_id)
+        page_token = None
+        while True:
+            if page_token:
+                params["pageToken"] = page_token
+            elif "pageToken" in params:
+                params.pop("pageToken")
+
+            data = await self._request("comments", params)
+            for it in data.get("items", []):
+                yield it
+
+            page_token = data.get("nextPageToken")
+            if not page_token:
+                break
+
+
+# Lets the blocking job pipeline (running in a worker thread) drive an AsyncYouTubeClient
+# whose requests are multiplexed on ``loop``.
+class BlockingYouTubeClient:
+    def __init__(self, client: AsyncYouTubeClient, loop: asyncio.AbstractEventLoop):
+        self.client = client
+        self.loop = loop
+
+    def fetch_comments(
+        self,
+        video_id: str,
+        limit: int = 500,
+        include_replies: bool = False,
+        progress_cb=None,
+        reply_workers: int = 1,
+        should_stop: Optional[Callable[[], bool]] = None,
+        stop_before: Optional[Callable[[Dict], bool]] = None,
+        cursor: Optional[FetchCursor] = None,
+    ) -> List[Dict]:
+        collected: List[Dict] = []
+        for page in self.iter_comment_pages(
+            video_id,
+            limit=limit,
+            include_replies=include_replies,
+            progress_cb=progress_cb,
+            reply_workers=reply_workers,
+            should_stop=should_stop,
+            stop_before=stop_before,
+            cursor=cursor,
+        ):
+            collected.extend(page)
+        return collected
+
+    def iter_comment_pages(
+        self,
+        video_id: str,
+        limit: int = 500,
+        include_replies: bool = False,
+        progress_cb=None,
+        reply_workers: int = 1,
+        should_stop: Optional[Callable[[], bool]] = None,
+        stop_before: Optional[Callable[[Dict], bool]] = None,
+        cursor: Optional[FetchCursor] = None,
+    ) -> Iterator[List[Dict]]:
+        # callbacks talk to Redis synchronously, so keep them off the event loop
+        async def _progress(count: int) -> None:
+            await self.loop.run_in_executor(_CALLBACK_EXECUTOR, progress_cb, count)
+
+        async def _should_stop() -> bool:
+            return await self.loop.run_in_executor(_CALLBACK_EXECUTOR, should_stop)
+
+        pages = self.client.iter_comment_pages(
+            video_id,
+            limit=limit,
+            include_replies=include_replies,
+            progress_cb=_progress if progress_cb else None,
+            reply_workers=reply_workers,
+            should_stop=_should_stop if should_stop else None,
+            stop_before=stop_before,
+            cursor=cursor,
+        )
+        try:
+            while True:
+                future = asyncio.run_coroutine_threadsafe(pages.__anext__(), self.loop)
+                try:
+                    page = future.result()
+                except StopAsyncIteration:
+                    return
+                except BaseException:
+                    future.cancel()
+                    raise
+                yield page
+        finally:
+            try:
+                asyncio.run_coroutine_threadsafe(pages.aclose(), self.loop).result()
+            except RuntimeError:
+                # the generator was still unwinding a cancelled __anext__; it closes itself
+                pass
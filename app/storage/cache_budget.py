@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import json
+import logging
+from typing import Optional
+
+from app.storage.cache_keys import (
+    yt_cache_bytes_key,
+    yt_cache_hits_key,
+    yt_cache_requests_key,
+    yt_cache_total_key,
+    yt_cache_usage_key,
+    yt_comments_index_key,
+    yt_comments_meta_key,
+    yt_fetch_lock_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# each hit counts like this many seconds of recency, for up to MAX_HITS hits; so an entry used
+# often stays ahead of one that was merely used last (LFU with LRU aging)
+HIT_WEIGHT_SECONDS = 600
+MAX_HITS = 8
+# large entries requested only once are kept this long (enough for resumes and waiting jobs)
+UNADMITTED_TTL_SECONDS = 60 * 15
+REQUESTS_TTL_SECONDS = 60 * 60 * 24
+STATS_TTL_SECONDS = 60 * 60 * 24 * 7
+# coldest entries looked at per eviction
+EVICT_SCAN = 16
+
+# KEYS: hits hash, usage zset; ARGV: cache key, hit increment, weight, max hits, stats ttl
+_TOUCH_SCRIPT = """
+local t = redis.call('TIME')
+local hits = redis.call('HINCRBY', KEYS[1], ARGV[1], tonumber(ARGV[2]))
+local score = tonumber(t[1]) + math.min(hits, tonumber(ARGV[4])) * tonumber(ARGV[3])
+redis.call('ZADD', KEYS[2], score, ARGV[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[5]))
+return hits
+"""
+
+# KEYS: bytes hash, total counter; ARGV: cache key, bytes added, stats ttl
+_GROW_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+redis.call('HINCRBY', KEYS[1], ARGV[1], tonumber(ARGV[2]))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+return redis.call('INCRBY', KEYS[2], tonumber(ARGV[2]))
+"""
+
+# KEYS: bytes hash, total counter; ARGV: cache key, new size (-1 forgets it), stats ttl
+_ACCOUNT_SCRIPT = """
+local old = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local new = tonumber(ARGV[2])
+if new < 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    new = 0
+else
+    redis.call('HSET', KEYS[1], ARGV[1], new)
+end
+local total = redis.call('INCRBY', KEYS[2], new - old)
+if total < 0 then
+    redis.call('SET', KEYS[2], 0)
+    total = 0
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+return total
+"""
+
+
+class CacheBudget:
+    # Keeps the comment cache's own footprint in Redis under `max_bytes`, so it is the cache
+    # that makes room and not the RQ, FSM and settings keys sharing the instance.
+    def __init__(self, r, max_bytes: int, admit_bytes: int):
+        self.r = r
+        self.max_bytes = max_bytes
+        self.admit_bytes = admit_bytes
+        self._touch = r.register_script(_TOUCH_SCRIPT)
+        self._account = r.register_script(_ACCOUNT_SCRIPT)
+        self._grow = r.register_script(_GROW_SCRIPT)
+
+    def record_request(self, cache_key: str) -> int:
+        key = yt_cache_requests_key(cache_key)
+        pipe = self.r.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, REQUESTS_TTL_SECONDS)
+        return int(pipe.execute()[0])
+
+    def requests(self, cache_key: str) -> int:
+        return int(self.r.get(yt_cache_requests_key(cache_key)) or 0)
+
+    def touch(self, cache_key: str, hit: bool = True) -> None:
+        self._touch(
+            keys=[yt_cache_hits_key(), yt_cache_usage_key()],
+            args=[cache_key, 1 if hit else 0, HIT_WEIGHT_SECONDS, MAX_HITS, STATS_TTL_SECONDS],
+        )
+
+    def admits(self, cache_key: str, nbytes: int) -> bool:
+        # a large entry earns its place by being asked for a second time
+        return nbytes <= self.admit_bytes or self.requests(cache_key) >= 2
+
+    def account(self, cache_key: str, nbytes: int) -> int:
+        total = int(self._account(keys=[yt_cache_bytes_key(), yt_cache_total_key()], args=[cache_key, nbytes, STATS_TTL_SECONDS]))
+        self.touch(cache_key, hit=False)
+        return total
+
+    def grow(self, cache_key: str, nbytes: int) -> int:
+        # for data added to an accounted entry after it was written (its search indexes)
+        return int(self._grow(keys=[yt_cache_bytes_key(), yt_cache_total_key()], args=[cache_key, nbytes, STATS_TTL_SECONDS]))
+
+    def forget(self, cache_key: str) -> None:
+        self._account(keys=[yt_cache_bytes_key(), yt_cache_total_key()], args=[cache_key, -1, STATS_TTL_SECONDS])
+        pipe = self.r.pipeline()
+        pipe.hdel(yt_cache_hits_key(), cache_key)
+        pipe.zrem(yt_cache_usage_key(), cache_key)
+        pipe.execute()
+
+    def tracked(self, cache_key: str) -> bool:
+        return bool(self.r.hexists(yt_cache_bytes_key(), cache_key))
+
+    def total(self) -> int:
+        return int(self.r.get(yt_cache_total_key()) or 0)
+
+    def enforce(self, protect: Optional[str] = None) -> int:
+        # evicts whole entries, coldest first, until the cache fits; returns how many went
+        evicted = 0
+        total = self.total()
+        while total > self.max_bytes:
+            # entries being fetched right now are left alone
+            victim = None
+            for raw in self.r.zrange(yt_cache_usage_key(), 0, EVICT_SCAN - 1):
+                candidate = raw.decode("utf-8")
+                if candidate != protect and not self.r.exists(yt_fetch_lock_key(candidate)):
+                    victim = candidate
+                    break
+            if victim is None:
+                break
+            self.drop(victim)
+            evicted += 1
+            total = self.total()
+        if evicted:
+            logger.info("Comment cache over budget, evicted %s entries (%s bytes left)", evicted, total)
+        return evicted
+
+    def drop(self, cache_key: str) -> None:
+        meta_key = yt_comments_meta_key(cache_key)
+        raw = self.r.get(meta_key)
+        keys = [meta_key]
+        if raw:
+            chunk_keys = [c["key"] for c in json.loads(raw.decode("utf-8")).get("chunks") or []]
+            keys.extend(chunk_keys)
+            keys.extend(yt_comments_index_key(k) for k in chunk_keys)
+        self.r.delete(*keys)
+        self.forget(cache_key)
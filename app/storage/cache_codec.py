@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import calendar
+import json
+import re
+import struct
+import sys
+import time
+import zlib
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services.comment import FIELDS, Comment
+
+# Cache blobs, version 1: MAGIC + zlib(header length, JSON header, column sections). Each field
+# of normalize_comment() is stored as one column, encoded by what its values allow:
+#   int   - fixed-width signed integers, the narrowest width that fits
+#   time  - publishedAt as deltas of epoch seconds (ints, as above)
+#   dict  - dictionary of distinct values (in the header) plus int indexes
+#   str   - character lengths (ints) plus the concatenated UTF-8 text
+#   json  - anything else, as a JSON list
+# Blobs without MAGIC are version 0 (zlib-compressed JSON list of dicts) and are still read.
+# Comments whose keys differ from FIELDS are written as version 0, so nothing is ever lost.
+
+MAGIC = b"YTC\x01"
+LEVEL = 6
+_TIME_RE = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ\Z")
+_INT_TYPES = [("b", 1 << 7), ("h", 1 << 15), ("i", 1 << 31), ("q", 1 << 63)]
+_SWAP = sys.byteorder != "little"
+
+
+def _int_section(values: List[int]) -> Tuple[str, bytes]:
+    lo, hi = (min(values), max(values)) if values else (0, 0)
+    for typecode, bound in _INT_TYPES:
+        if -bound <= lo and hi < bound:
+            break
+    packed = array(typecode, values)
+    if _SWAP:
+        packed.byteswap()
+    return typecode, packed.tobytes()
+
+
+def _read_ints(typecode: str, data: bytes) -> List[int]:
+    packed = array(typecode)
+    packed.frombytes(data)
+    if _SWAP:
+        packed.byteswap()
+    return packed.tolist()
+
+
+def _epoch(value: str, days: Dict[str, Optional[int]]) -> Optional[int]:
+    # only timestamps that format back to the very same string; `days` caches midnight per date
+    if not _TIME_RE.match(value):
+        return None
+    day = value[:10]
+    midnight = days.get(day, -1)
+    if midnight == -1:
+        try:
+            midnight = calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]), 0, 0, 0))
+        except ValueError:
+            midnight = None
+        if midnight is not None and time.strftime("%Y-%m-%d", time.gmtime(midnight)) != day:
+            midnight = None
+        days[day] = midnight
+    hours, minutes, seconds = int(value[11:13]), int(value[14:16]), int(value[17:19])
+    if midnight is None or hours > 23 or minutes > 59 or seconds > 59:
+        return None
+    return midnight + hours * 3600 + minutes * 60 + seconds
+
+
+_HOURS_MINUTES = [f"{h:02d}:{m:02d}:" for h in range(24) for m in range(60)]
+_SECONDS = [f"{sec:02d}Z" for sec in range(60)]
+
+
+def _format_times(deltas: List[int]) -> List[str]:
+    days: Dict[int, str] = {}
+    out = []
+    for t in accumulate(deltas):
+        day, rest = divmod(t, 86400)
+        prefix = days.get(day)
+        if prefix is None:
+            prefix = days[day] = time.strftime("%Y-%m-%dT", time.gmtime(day * 86400))
+        minute, sec = divmod(rest, 60)
+        out.append(prefix + _HOURS_MINUTES[minute] + _SECONDS[sec])
+    return out
+
+
+def _is_int(value) -> bool:
+    return type(value) is int and -(1 << 63) <= value < (1 << 63)
+
+
+def _encode_column(values: List) -> Tuple[Dict, bytes]:
+    if all(_is_int(v) for v in values):
+        typecode, data = _int_section(values)
+        return {"enc": "int", "type": typecode}, data
+    if values and all(type(v) is str for v in values):
+        days: Dict[str, Optional[int]] = {}
+        seconds = [_epoch(v, days) for v in values]
+        if None not in seconds:
+            typecode, data = _int_section([b - a for a, b in zip([0] + seconds, seconds)])
+            return {"enc": "time", "type": typecode}, data
+    if all(v is None or type(v) is str for v in values):
+        distinct = list(dict.fromkeys(values))
+        if None in distinct or len(distinct) * 2 <= len(values):
+            index = {v: i for i, v in enumerate(distinct)}
+            typecode, data = _int_section([index[v] for v in values])
+            return {"enc": "dict", "type": typecode, "values": distinct}, data
+        typecode, lengths = _int_section([len(v) for v in values])
+        return {"enc": "str", "type": typecode, "lengths": len(lengths)}, lengths + "".join(values).encode("utf-8")
+    return {"enc": "json"}, json.dumps(values, ensure_ascii=False).encode("utf-8")
+
+
+def _decode_column(meta: Dict, data: bytes) -> List:
+    enc = meta["enc"]
+    if enc == "int":
+        return _read_ints(meta["type"], data)
+    if enc == "time":
+        return _format_times(_read_ints(meta["type"], data))
+    if enc == "dict":
+        values = meta["values"]
+        return [values[i] for i in _read_ints(meta["type"], data)]
+    if enc == "str":
+        split = meta["lengths"]
+        text = data[split:].decode("utf-8")
+        offsets = [0, *accumulate(_read_ints(meta["type"], data[:split]))]
+        return [text[a:b] for a, b in zip(offsets, offsets[1:])]
+    if enc == "json":
+        return json.loads(data.decode("utf-8"))
+    raise ValueError(f"unknown cache column encoding: {enc}")
+
+
+def encode_legacy(comments: List[Dict]) -> bytes:
+    rows = [c.to_dict() if type(c) is Comment else c for c in comments]
+    raw = json.dumps(rows, ensure_ascii=False).encode("utf-8")
+    return zlib.compress(raw, level=LEVEL)
+
+
+def _encode_columns(n: int, columns: List[List]) -> bytes:
+    metas: List[Dict] = []
+    sections: List[bytes] = []
+    for name, values in zip(FIELDS, columns):
+        meta, data = _encode_column(values)
+        meta["name"] = name
+        meta["size"] = len(data)
+        metas.append(meta)
+        sections.append(data)
+    header = json.dumps({"n": n, "columns": metas}, ensure_ascii=False).encode("utf-8")
+    body = struct.pack("<I", len(header)) + header + b"".join(sections)
+    return MAGIC + zlib.compress(body, level=LEVEL)
+
+
+def encode_comments(comments: List[Dict]) -> bytes:
+    encoder = CommentEncoder()
+    encoder.add(comments)
+    return encoder.finish()
+
+
+def decode_comments(blob: bytes) -> List[Dict]:
+    if not blob.startswith(MAGIC):
+        rows = json.loads(zlib.decompress(blob).decode("utf-8"))
+        return [Comment(*row.values()) if tuple(row) == FIELDS else row for row in rows]
+    body = zlib.decompress(memoryview(blob)[len(MAGIC):])
+    (header_size,) = struct.unpack_from("<I", body)
+    pos = 4 + header_size
+    header = json.loads(body[4:pos].decode("utf-8"))
+    columns = []
+    for meta in header["columns"]:
+        columns.append(_decode_column(meta, body[pos:pos + meta["size"]]))
+        pos += meta["size"]
+    names = tuple(meta["name"] for meta in header["columns"])
+    if names == FIELDS:
+        return list(map(Comment, *columns))
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+class CommentEncoder:
+    # collects pages column by column, so the row dicts can be freed as the stream moves on
+    def __init__(self) -> None:
+        self._columns: List[List] = [[] for _ in FIELDS]
+        self._count = 0
+        self._rows: Optional[List[Dict]] = None
+
+    def add(self, comments: Iterable[Dict]) -> None:
+        for c in comments:
+            if self._rows is None and type(c) is not Comment and tuple(c) != FIELDS:
+                self._rows = self._materialize()
+            if self._rows is not None:
+                self._rows.append(c)
+                continue
+            for column, value in zip(self._columns, c.values()):
+                column.append(value)
+            self._count += 1
+
+    def __len__(self) -> int:
+        return len(self._rows) if self._rows is not None else self._count
+
+    def _materialize(self) -> List[Dict]:
+        rows = [dict(zip(FIELDS, row)) for row in zip(*self._columns)]
+        self._columns = [[] for _ in FIELDS]
+        return rows
+
+    def finish(self) -> bytes:
+        if self._rows is not None:
+            return encode_legacy(self._rows)
+        return _encode_columns(self._count, self._columns)
@@ -17,6 +17,73 @@ def yt_comments_cache_key(video_id: str, params: Dict[str, Any]) -> str:
     return f"yt:comments:{video_id}:{h}"
 
 
+def yt_video_comments_key(video_id: str, include_replies: bool) -> str:
+    # one entry per video and replies setting, whatever the limit
+    return yt_comments_cache_key(video_id, {"include_replies": include_replies})
+
+
+def export_artifact_key(signature: Dict[str, Any]) -> str:
+    payload = json.dumps(signature, sort_keys=True, ensure_ascii=True)
+    h = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+    return f"export:artifact:{h}"
+
+
+def async_job_queue_key() -> str:
+    return "jobs:async:queue"
+
+
+def yt_quota_bucket_key() -> str:
+    return "yt:quota:bucket"
+
+
+def yt_key_used_key(fingerprint: str, day: str) -> str:
+    return f"yt:key:{fingerprint}:used:{day}"
+
+
+def yt_key_retired_key(fingerprint: str, day: str) -> str:
+    return f"yt:key:{fingerprint}:retired:{day}"
+
+
+def yt_comments_meta_key(cache_key: str) -> str:
+    return f"{cache_key}:meta"
+
+
+def yt_comments_chunk_key(cache_key: str, chunk_id: str) -> str:
+    return f"{cache_key}:chunk:{chunk_id}"
+
+
+def yt_comments_index_key(chunk_key: str) -> str:
+    return f"{chunk_key}:index"
+
+
+def yt_fetch_lock_key(cache_key: str) -> str:
+    return f"{cache_key}:lock"
+
+
+def yt_fetch_progress_key(cache_key: str) -> str:
+    return f"{cache_key}:lock:progress"
+
+
+def yt_cache_requests_key(cache_key: str) -> str:
+    return f"{cache_key}:requests"
+
+
+def yt_cache_bytes_key() -> str:
+    return "yt:cache:bytes"
+
+
+def yt_cache_total_key() -> str:
+    return "yt:cache:total"
+
+
+def yt_cache_usage_key() -> str:
+    return "yt:cache:usage"
+
+
+def yt_cache_hits_key() -> str:
+    return "yt:cache:hits"
+
+
 def job_status_key(job_id: str) -> str:
     return f"job:{job_id}:status"
 
@@ -0,0 +1,388 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from app.storage.cache_budget import UNADMITTED_TTL_SECONDS, CacheBudget
+from app.storage.cache_codec import CommentEncoder, decode_comments
+from app.storage.cache_keys import yt_comments_chunk_key, yt_comments_index_key, yt_comments_meta_key
+from app.storage.comment_index import Candidates, CommentIndex
+from app.storage.decoded_cache import DecodedChunkCache
+
+logger = logging.getLogger(__name__)
+
+# entries younger than this are served as-is
+CACHE_TTL_SECONDS = 60 * 60 * 12
+# stale entries are kept this long so the next job can refresh them incrementally
+CACHE_RETAIN_SECONDS = 60 * 60 * 24 * 3
+# newest top-level ids remembered per entry, in case the very newest comment gets deleted
+HEAD_IDS = 20
+# comments per chunk, a few API pages' worth; chunks are cut at page boundaries
+CHUNK_COMMENTS = 500
+# chunks fetched per MGET when reading an entry
+READ_BATCH = 8
+# a rewritten open chunk's previous blob stays readable this long for jobs still reading it
+SUPERSEDED_TTL_SECONDS = 60 * 15
+
+
+class CacheChunkMissing(RuntimeError):
+    pass
+
+
+def entry_version(fetched_at: float, head_ids: List[str]) -> str:
+    # changes whenever the start of the comment list can have changed: extending an entry keeps
+    # fetched_at but puts newly posted comments (and so new head ids) in front
+    return f"{fetched_at:.6f}:{head_ids[0] if head_ids else ''}"
+
+
+class _HeadTracker:
+    # remembers the newest top-level comments of a time-ordered stream
+    def __init__(self) -> None:
+        self.ids: List[str] = []
+        self.newest_published_at: Optional[str] = None
+
+    def add(self, comments: Iterable[Dict]) -> None:
+        for c in comments:
+            if len(self.ids) >= HEAD_IDS:
+                return
+            if c.get("parent_id") is None and c.get("comment_id"):
+                self.ids.append(c["comment_id"])
+                published_at = c.get("published_at")
+                if published_at and (self.newest_published_at is None or published_at > self.newest_published_at):
+                    self.newest_published_at = published_at
+
+
+@dataclass
+class CacheEntry:
+    # the manifest of a cached comment list; the comments themselves live in `chunks`
+    count: int
+    fetched_at: float
+    head_ids: List[str] = field(default_factory=list)
+    newest_published_at: Optional[str] = None
+    # FetchCursor.to_dict() of where the fetch stopped; None for entries that cannot be extended
+    cursor: Optional[Dict] = None
+    # [{"key": chunk key, "count": comments in it, "bytes": blob size}, ...] in stream order
+    chunks: List[Dict] = field(default_factory=list)
+    threads: int = 0
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.cursor and self.cursor.get("exhausted"))
+
+    def is_fresh(self, ttl: int = CACHE_TTL_SECONDS) -> bool:
+        return time.time() - self.fetched_at < ttl
+
+    @property
+    def version(self) -> str:
+        return entry_version(self.fetched_at, self.head_ids)
+
+    def covers(self, limit: int) -> bool:
+        return self.complete or self.count >= limit
+
+    def is_known(self, comment: Dict) -> bool:
+        if comment.get("comment_id") in self.head_ids:
+            return True
+        published_at = comment.get("published_at")
+        return bool(self.newest_published_at and published_at and published_at < self.newest_published_at)
+
+    def chunks_for(self, limit: Optional[int] = None) -> List[Dict]:
+        if limit is None:
+            return list(self.chunks)
+        needed: List[Dict] = []
+        total = 0
+        for chunk in self.chunks:
+            if total >= limit:
+                break
+            needed.append(chunk)
+            total += chunk["count"]
+        return needed
+
+
+class CommentCache:
+    # An entry is a manifest under `{key}:meta` listing immutable chunk blobs. Writers only add
+    # chunks and then replace the manifest, so readers always see a consistent entry, and a
+    # fetch in progress publishes what it has after every page (a crashed or cancelled job's
+    # successor just extends it).
+    # `memory` keeps decoded chunks in process, so repeated reads skip Redis and decoding;
+    # `budget` accounts every entry written and evicts cold ones once the cache is over it.
+    def __init__(
+        self,
+        r,
+        ttl: int = CACHE_TTL_SECONDS,
+        retain: int = CACHE_RETAIN_SECONDS,
+        memory: Optional[DecodedChunkCache] = None,
+        budget: Optional[CacheBudget] = None,
+    ):
+        self.r = r
+        self.ttl = ttl
+        self.retain = max(retain, ttl)
+        self.memory = memory
+        self.budget = budget
+
+    def load(self, key: str) -> Optional[CacheEntry]:
+        meta_raw = self.r.get(yt_comments_meta_key(key))
+        if not meta_raw:
+            return None
+        meta = json.loads(meta_raw.decode("utf-8"))
+        chunks = meta.get("chunks")
+        if chunks is None:
+            return None
+        # chunks can be evicted one by one under maxmemory; a gap makes the entry unusable
+        if chunks and self.r.exists(*[c["key"] for c in chunks]) < len(chunks):
+            return None
+        return CacheEntry(
+            count=sum(c["count"] for c in chunks),
+            fetched_at=float(meta.get("fetched_at", 0)),
+            head_ids=meta.get("head_ids") or [],
+            newest_published_at=meta.get("newest_published_at"),
+            cursor=meta.get("cursor"),
+            chunks=chunks,
+            threads=int(meta.get("threads") or 0),
+        )
+
+    def read(self, entry: CacheEntry, limit: Optional[int] = None) -> Iterator[List[Dict]]:
+        # decoded chunks in order, reading only as many as the first `limit` comments need
+        needed = entry.chunks_for(limit)
+        for i in range(0, len(needed), READ_BATCH):
+            batch = [c["key"] for c in needed[i:i + READ_BATCH]]
+            decoded = self._load_chunks(batch)
+            for key in batch:
+                yield decoded[key]
+
+    def _load_chunks(self, keys: List[str]) -> Dict[str, List[Dict]]:
+        decoded = {key: self._remembered(key) for key in keys}
+        missing = [key for key, comments in decoded.items() if comments is None]
+        if missing:
+            for key, blob in zip(missing, self.r.mget(missing)):
+                if blob is None:
+                    raise CacheChunkMissing(f"cache chunk {key} expired")
+                decoded[key] = decode_comments(blob)
+                self._remember(key, decoded[key])
+        return decoded
+
+    def read_candidates(
+        self,
+        key: str,
+        entry: CacheEntry,
+        keywords: List[str],
+        mode: str = "any",
+        limit: Optional[int] = None,
+    ) -> Iterator[Candidates]:
+        # read() narrowed down by the chunks' keyword indexes: only the comments that may match
+        # `keywords`, and chunks with none of them are not even loaded. A chunk's index is built
+        # the first time it is searched; chunks never change, so it stays valid for good.
+        needed = entry.chunks_for(limit)
+        seen = 0
+        for i in range(0, len(needed), READ_BATCH):
+            batch = needed[i:i + READ_BATCH]
+            indexes: List[Optional[CommentIndex]] = []
+            for blob in self.r.mget([yt_comments_index_key(c["key"]) for c in batch]):
+                try:
+                    indexes.append(CommentIndex.decode(blob) if blob is not None else None)
+                except ValueError:
+                    indexes.append(None)
+            positions = [index.candidates(keywords, mode) if index is not None else None for index in indexes]
+            load = [c["key"] for c, index, found in zip(batch, indexes, positions) if index is None or found != set()]
+            decoded = self._load_chunks(load) if load else {}
+            for chunk, index, found in zip(batch, indexes, positions):
+                count = chunk["count"] if limit is None else min(chunk["count"], limit - seen)
+                seen += count
+                comments = decoded.get(chunk["key"])
+                if index is None:
+                    found = self._index(key, chunk, comments).candidates(keywords, mode)
+                if found is None or len(found) >= chunk["count"]:
+                    yield Candidates(comments[:count], count)
+                else:
+                    yield Candidates([comments[p] for p in sorted(found) if p < count], count)
+
+    def _index(self, key: str, chunk: Dict, comments: List[Dict]) -> CommentIndex:
+        index = CommentIndex.build(comments)
+        blob = index.encode()
+        # lives as long as its chunk; republishing the entry extends both
+        ttl = self.r.ttl(chunk["key"])
+        if ttl is not None and ttl > 0:
+            self.r.setex(yt_comments_index_key(chunk["key"]), ttl, blob)
+            if self.budget is not None:
+                self.budget.grow(key, len(blob))
+        return index
+
+    def index_bytes(self, chunks: List[Dict]) -> int:
+        if not chunks:
+            return 0
+        pipe = self.r.pipeline()
+        for chunk in chunks:
+            pipe.strlen(yt_comments_index_key(chunk["key"]))
+        return sum(pipe.execute())
+
+    def _remembered(self, key: str) -> Optional[List[Dict]]:
+        return self.memory.get(key) if self.memory is not None else None
+
+    def _remember(self, key: str, comments: List[Dict]) -> None:
+        if self.memory is not None:
+            self.memory.put(key, comments)
+
+    def hit(self, key: str, entry: CacheEntry) -> None:
+        # counts a hit; an entry that was not admitted is kept for good once asked for again
+        budget = self.budget
+        if budget is None:
+            return
+        budget.touch(key)
+        nbytes = sum(c.get("bytes") or 0 for c in entry.chunks)
+        if budget.tracked(key) or not budget.admits(key, nbytes):
+            return
+        pipe = self.r.pipeline()
+        for chunk in entry.chunks:
+            pipe.expire(chunk["key"], self.retain)
+            pipe.expire(yt_comments_index_key(chunk["key"]), self.retain)
+        pipe.expire(yt_comments_meta_key(key), self.retain)
+        pipe.execute()
+        budget.account(key, nbytes + self.index_bytes(entry.chunks))
+        budget.enforce(protect=key)
+
+    def discard(self, entry: CacheEntry) -> None:
+        # an entry replaced by one that does not reuse its chunks: delete them now, as the
+        # budget only accounts the chunks of the current manifest
+        keys = [c["key"] for c in entry.chunks]
+        if keys:
+            self.r.delete(*keys, *(yt_comments_index_key(k) for k in keys))
+
+    def writer(self, key: str, cursor, fetched_at: Optional[float] = None) -> "CacheWriter":
+        return CacheWriter(self, key, cursor, fetched_at)
+
+
+class CacheWriter:
+    # Builds a new version of an entry: newly fetched head pages, then the chunks of the entry
+    # it extends (reused as they are), then newly fetched tail pages. `cursor` (a FetchCursor)
+    # must match the pages added so far whenever add(), attach() or finish() is called; it is
+    # snapshotted there, so a checkpoint() after a failure mid-page records the last whole page.
+    # Once attached, every page is published: the comments since the last full chunk go out as
+    # an open chunk, rewritten under a new key with each page until it reaches CHUNK_COMMENTS,
+    # so a job killed outright (OOM, SIGKILL) loses at most the page it was fetching.
+    def __init__(self, cache: CommentCache, key: str, cursor, fetched_at: Optional[float] = None):
+        self.cache = cache
+        self.key = key
+        self.cursor = cursor
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.chunks: List[Dict] = []
+        self.threads = 0
+        self._buffer = CommentEncoder()
+        # the chunk in `chunks` holding the buffer as of the last publish, and the blobs it replaced
+        self._open: Optional[Dict] = None
+        self._superseded: List[str] = []
+        self._head = _HeadTracker()
+        self._base: Optional[CacheEntry] = None
+        self._attached = False
+        self._dirty = False
+        self._finished = False
+        self._position = self._snapshot()
+
+    @property
+    def version(self) -> str:
+        return entry_version(self.fetched_at, self._head.ids)
+
+    def add(self, page: List[Dict]) -> None:
+        self._buffer.add(page)
+        self.threads += sum(1 for c in page if c.get("parent_id") is None)
+        if self._base is None:
+            self._head.add(page)
+        self._position = self._snapshot()
+        if self._attached:
+            self._flush(seal=len(self._buffer) >= CHUNK_COMMENTS)
+            self._publish()
+
+    def attach(self, base: Optional[CacheEntry]) -> None:
+        # head pages are done; from here on the manifest is published after every page
+        self._flush()
+        if base is not None:
+            if len(self._head.ids) < HEAD_IDS:
+                self._head.ids.extend(base.head_ids[: HEAD_IDS - len(self._head.ids)])
+            if base.newest_published_at and (
+                self._head.newest_published_at is None or base.newest_published_at > self._head.newest_published_at
+            ):
+                self._head.newest_published_at = base.newest_published_at
+            self.chunks.extend(base.chunks)
+            self.threads += base.threads
+        self._base = base
+        self._attached = True
+        self._position = self._snapshot()
+        if self._dirty:
+            self._publish()
+
+    def finish(self) -> None:
+        self._position = self._snapshot()
+        self._flush()
+        self._publish(final=True)
+        self._finished = True
+
+    def checkpoint(self) -> None:
+        # the fetch was cancelled or failed: publish what it has, partial chunk included, so the
+        # next job resumes from here. Head pages are dropped: without the entry they extend
+        # they would leave a gap.
+        if not self._attached or self._finished:
+            return
+        self._flush()
+        if self._dirty:
+            self._publish()
+
+    def _snapshot(self) -> Optional[Dict]:
+        return self.cursor.to_dict() if self.cursor is not None else None
+
+    def _flush(self, seal: bool = True) -> None:
+        # writes the buffer as a chunk; unsealed, the buffer stays open for the next pages
+        count = len(self._buffer)
+        if count and (self._open is None or self._open["count"] != count):
+            chunk_key = yt_comments_chunk_key(self.key, uuid.uuid4().hex[:16])
+            blob = self._buffer.finish()
+            self.cache.r.setex(chunk_key, self.cache.retain, blob)
+            chunk = {"key": chunk_key, "count": count, "bytes": len(blob)}
+            if self._open is not None:
+                self._superseded.append(self._open["key"])
+                self.chunks[-1] = chunk
+            else:
+                self.chunks.append(chunk)
+            self._open = chunk
+            self._dirty = True
+        if seal:
+            self._buffer = CommentEncoder()
+            self._open = None
+
+    def _publish(self, final: bool = False) -> None:
+        meta = {
+            "fetched_at": self.fetched_at,
+            "head_ids": self._head.ids,
+            "newest_published_at": self._head.newest_published_at,
+            "cursor": self._position,
+            "count": sum(c["count"] for c in self.chunks),
+            "threads": self.threads,
+            "chunks": self.chunks,
+        }
+        raw = json.dumps(meta).encode("utf-8")
+        nbytes = len(raw) + sum(c.get("bytes") or 0 for c in self.chunks)
+        budget = self.cache.budget
+        retain = self.cache.retain
+        admitted = budget is None or not final or budget.admits(self.key, nbytes)
+        if not admitted:
+            logger.info("Not admitting %s (%s bytes, requested once); keeping it briefly", self.key, nbytes)
+            retain = UNADMITTED_TTL_SECONDS
+        pipe = self.cache.r.pipeline()
+        for chunk in self.chunks:
+            pipe.expire(chunk["key"], retain)
+            pipe.expire(yt_comments_index_key(chunk["key"]), retain)
+        pipe.setex(yt_comments_meta_key(self.key), retain, raw)
+        for chunk_key in self._superseded:
+            pipe.expire(chunk_key, min(retain, SUPERSEDED_TTL_SECONDS))
+            pipe.delete(yt_comments_index_key(chunk_key))
+        pipe.execute()
+        self._superseded = []
+        self._dirty = False
+        if budget is None:
+            return
+        if admitted:
+            budget.account(self.key, nbytes + self.cache.index_bytes(self.chunks))
+            budget.enforce(protect=self.key)
+        else:
+            budget.forget(self.key)
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import re
+import struct
+import sys
+import zlib
+from array import array
+from typing import Dict, Iterable, List, Optional, Set
+
+# Inverted index of one cache chunk: every word (\w+ run) of the casefolded texts, with the
+# positions in the chunk of the comments containing it. Keywords match anywhere in the text,
+# not only whole words, so a keyword is looked up by its own words: each of them lies inside one
+# word of any text the keyword occurs in, so the comments holding a word of the vocabulary
+# that contains it are a superset of the matches. Callers recheck those with the exact filter.
+#
+# Blob: MAGIC + zlib(word count, position count, offsets, positions, words joined by "\n").
+
+MAGIC = b"YTI\x01"
+LEVEL = 6
+_WORD = re.compile(r"\w+")
+_SWAP = sys.byteorder != "little"
+
+
+def _pack(values: Iterable[int]) -> bytes:
+    packed = array("I", values)
+    if _SWAP:
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(data: bytes) -> array:
+    packed = array("I")
+    packed.frombytes(data)
+    if _SWAP:
+        packed.byteswap()
+    return packed
+
+
+class Candidates(list):
+    # the comments of a chunk that may match, out of `scanned` that were looked at
+    __slots__ = ("scanned",)
+
+    def __init__(self, comments: Iterable[Dict], scanned: int):
+        super().__init__(comments)
+        self.scanned = scanned
+
+
+class CommentIndex:
+    def __init__(self, words: List[str], offsets: array, positions: array):
+        self.words = words
+        self.offsets = offsets
+        self.positions = positions
+        self._vocabulary = "\n".join(words)
+        self._ids: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def build(cls, comments: List[Dict]) -> "CommentIndex":
+        postings: Dict[str, List[int]] = {}
+        for i, c in enumerate(comments):
+            for word in set(_WORD.findall((c.get("text") or "").casefold())):
+                postings.setdefault(word, []).append(i)
+        words = list(postings)
+        offsets = [0]
+        positions: List[int] = []
+        for word in words:
+            positions.extend(postings[word])
+            offsets.append(len(positions))
+        return cls(words, array("I", offsets), array("I", positions))
+
+    def encode(self) -> bytes:
+        body = (
+            struct.pack("<II", len(self.words), len(self.positions))
+            + _pack(self.offsets)
+            + _pack(self.positions)
+            + "\n".join(self.words).encode("utf-8")
+        )
+        return MAGIC + zlib.compress(body, level=LEVEL)
+
+    @classmethod
+    def decode(cls, blob: bytes) -> "CommentIndex":
+        if not blob.startswith(MAGIC):
+            raise ValueError("not a comment index blob")
+        body = zlib.decompress(memoryview(blob)[len(MAGIC):])
+        count, npositions = struct.unpack_from("<II", body)
+        pos = 8
+        offsets = _unpack(body[pos:pos + 4 * (count + 1)])
+        pos += 4 * (count + 1)
+        positions = _unpack(body[pos:pos + 4 * npositions])
+        pos += 4 * npositions
+        words = body[pos:].decode("utf-8").split("\n") if count else []
+        return cls(words, offsets, positions)
+
+    def _containing(self, piece: str) -> Set[int]:
+        # positions of the comments with a word containing `piece`
+        if self._ids is None:
+            self._ids = {w: i for i, w in enumerate(self.words)}
+        found: Set[int] = set()
+        pattern = re.compile(r"^[^\n]*" + re.escape(piece) + r"[^\n]*$", re.MULTILINE)
+        for word in pattern.findall(self._vocabulary):
+            i = self._ids[word]
+            found.update(self.positions[self.offsets[i]:self.offsets[i + 1]])
+        return found
+
+    def candidates(self, keywords: List[str], mode: str = "any") -> Optional[Set[int]]:
+        # positions that may match the keywords; None when the index cannot narrow them down
+        # (a keyword without any word characters, under `any`)
+        result: Optional[Set[int]] = None
+        for keyword in keywords:
+            pieces = _WORD.findall(keyword.casefold())
+            if not pieces:
+                if mode == "all":
+                    continue
+                return None
+            hits: Optional[Set[int]] = None
+            for piece in sorted(pieces, key=len, reverse=True):
+                found = self._containing(piece)
+                hits = found if hits is None else hits & found
+                if not hits:
+                    break
+            if mode == "all":
+                result = hits if result is None else result & hits
+                if not result:
+                    return set()
+            else:
+                result = hits if result is None else result | hits
+        return result
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def comments_size(comments: List[Dict]) -> int:
+    # rough resident size of decoded comments; shared strings are counted once per comment,
+    # which overestimates a little and keeps the budget on the safe side
+    size = sys.getsizeof(comments)
+    for c in comments:
+        size += sys.getsizeof(c)
+        for value in c.values():
+            size += sys.getsizeof(value)
+    return size
+
+
+class DecodedChunkCache:
+    # In-process LRU of decoded cache chunks, bounded by an estimate of their size in bytes.
+    # Chunk keys are never rewritten (a changed entry lists new chunks in its manifest), so
+    # entries cannot go stale here; old chunks simply stop being asked for and age out.
+    # The lists handed out are shared between jobs and must not be modified.
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: "OrderedDict[str, Tuple[List[Dict], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: str, comments: List[Dict]) -> None:
+        size = comments_size(comments)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._items[key] = (comments, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        return {
+            "items": len(self._items),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from app.services.export import output_compression
+from app.services.query import normalize_query
+from app.storage.cache_keys import export_artifact_key
+from app.storage.comment_cache import CACHE_TTL_SECONDS, entry_version
+
+# bump when an exporter changes what it writes for the same settings
+EXPORT_VERSION = 1
+# an artifact is only found through the cache entry version it was built from, so it never
+# outlives that entry's freshness by much
+ARTIFACT_TTL_SECONDS = CACHE_TTL_SECONDS
+DEFAULT_FIELDS = ["author", "published_at", "like_count", "text"]
+
+
+def export_signature(settings: Dict[str, Any], default_limit: int) -> Dict[str, Any]:
+    # everything that decides the exported file, in a canonical form, so equal exports hash equally
+    case_sensitive = bool(settings.get("keywords_case_sensitive", False))
+    keywords = [k for k in (settings.get("keywords") or []) if k.strip()]
+    if not case_sensitive:
+        keywords = [k.casefold() for k in keywords]
+    query = normalize_query(settings.get("query"))
+    return {
+        "video_id": settings["video_id"],
+        "include_replies": bool(settings.get("include_replies", False)),
+        "limit": int(settings.get("limit", default_limit)),
+        "keywords": sorted(set(keywords)),
+        "keywords_mode": settings.get("keywords_mode", "any") if keywords else "any",
+        # the query is matched with the same case setting
+        "keywords_case_sensitive": case_sensitive if keywords or query else False,
+        "min_len": settings.get("min_len") or None,
+        "query": query,
+        "min_likes": settings.get("min_likes"),
+        "max_likes": settings.get("max_likes"),
+        "after": settings.get("after"),
+        "before": settings.get("before"),
+        "sort": settings.get("sort", "none"),
+        "fields": list(settings.get("fields") or DEFAULT_FIELDS),
+        "format": settings.get("format", "csv"),
+        "compress": output_compression(settings.get("format", "csv"), settings.get("compress")),
+    }
+
+
+def artifact_key(settings: Dict[str, Any], cache_version: str, default_limit: int) -> str:
+    signature = export_signature(settings, default_limit)
+    signature["cache_version"] = cache_version
+    signature["export_version"] = EXPORT_VERSION
+    return export_artifact_key(signature)
+
+
+def manifest_version(meta_raw: Optional[bytes]) -> Optional[str]:
+    # version of a fresh cache entry from its raw manifest; None when it is missing or stale
+    if not meta_raw:
+        return None
+    try:
+        meta = json.loads(meta_raw.decode("utf-8"))
+    except ValueError:
+        return None
+    fetched_at = float(meta.get("fetched_at") or 0)
+    if time.time() - fetched_at >= CACHE_TTL_SECONDS:
+        return None
+    return entry_version(fetched_at, meta.get("head_ids") or [])
+
+
+def parse_artifact(raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    if not raw:
+        return None
+    try:
+        data = json.loads(raw.decode("utf-8"))
+    except ValueError:
+        return None
+    return data if data.get("file_path") or data.get("file_id") else None
+
+
+def servable(artifact: Optional[Dict[str, Any]]) -> bool:
+    # a Telegram file_id outlives the file on disk
+    if not artifact:
+        return False
+    return bool(artifact.get("file_id")) or bool(artifact.get("file_path") and os.path.exists(artifact["file_path"]))
+
+
+def load_artifact(r, key: str) -> Optional[Dict[str, Any]]:
+    return parse_artifact(r.get(key))
+
+
+def save_artifact(r, key: str, artifact: Dict[str, Any]) -> None:
+    r.setex(key, ARTIFACT_TTL_SECONDS, json.dumps(artifact).encode("utf-8"))
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import json
+import threading
+from typing import Dict, Optional
+
+from app.storage.cache_keys import yt_fetch_lock_key, yt_fetch_progress_key
+
+# a leader that stops renewing (crashed, OOM-killed) loses the lock after this long
+FETCH_LOCK_TTL_SECONDS = 30
+RENEW_INTERVAL_SECONDS = 10
+
+# both only act while ARGV[1] still holds the lock
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1], KEYS[2])
+end
+return 0
+"""
+
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+    return 1
+end
+return 0
+"""
+
+
+class FetchLock:
+    # Single-flight lock for fetching one cache entry. The holder renews it from a background
+    # thread and reports its progress next to it, so waiting jobs can show it to their users.
+    def __init__(self, r, cache_key: str, owner: str, ttl: int = FETCH_LOCK_TTL_SECONDS):
+        self.r = r
+        self.owner = owner
+        self.ttl = ttl
+        self.key = yt_fetch_lock_key(cache_key)
+        self.progress_key = yt_fetch_progress_key(cache_key)
+        self._release = r.register_script(_RELEASE_SCRIPT)
+        self._renew = r.register_script(_RENEW_SCRIPT)
+        self._stop: Optional[threading.Event] = None
+
+    @property
+    def held(self) -> bool:
+        return self._stop is not None and not self._stop.is_set()
+
+    def acquire(self) -> bool:
+        if self.held:
+            return True
+        if not self.r.set(self.key, self.owner.encode("utf-8"), nx=True, ex=self.ttl):
+            return False
+        self._stop = threading.Event()
+        threading.Thread(target=self._keep_alive, args=(self._stop,), name="fetch-lock", daemon=True).start()
+        return True
+
+    def _keep_alive(self, stop: threading.Event) -> None:
+        while not stop.wait(RENEW_INTERVAL_SECONDS):
+            try:
+                if not self._renew(keys=[self.key], args=[self.owner, self.ttl]):
+                    stop.set()
+            except Exception:
+                # Redis hiccup; the next round retries while the lock has not expired yet
+                pass
+
+    def release(self) -> None:
+        if self._stop is None:
+            return
+        self._stop.set()
+        self._stop = None
+        self._release(keys=[self.key, self.progress_key], args=[self.owner])
+
+    def report(self, payload: Dict) -> None:
+        if self.held:
+            self.r.setex(self.progress_key, self.ttl, json.dumps(payload).encode("utf-8"))
+
+    def leader_progress(self) -> Dict:
+        raw = self.r.get(self.progress_key)
+        if not raw:
+            return {}
+        try:
+            return json.loads(raw.decode("utf-8"))
+        except ValueError:
+            return {}
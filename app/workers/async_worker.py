@@ -0,0 +1,72 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import Config
+from app.logging import setup_logging
+from app.services.key_pool import AsyncApiKeyPool
+from app.services.quota import AsyncQuotaScheduler
+from app.services.youtube_async import AsyncYouTubeClient
+from app.storage.cache_keys import async_job_queue_key
+from app.storage.redis import get_redis_async
+from app.workers.tasks import fetch_and_export_async
+
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+async def _run_one(raw: bytes, client: AsyncYouTubeClient, slots: asyncio.Semaphore) -> None:
+    try:
+        job = json.loads(raw.decode("utf-8"))
+        await fetch_and_export_async(job["job_id"], job["settings"], client)
+    except Exception as exc:
+        logger.warning("Async job failed: %s", exc)
+    finally:
+        slots.release()
+
+
+async def serve() -> None:
+    config = Config.from_env()
+    redis_async = get_redis_async(config.redis_url)
+    concurrency = max(config.async_job_concurrency, 1)
+
+    loop = asyncio.get_running_loop()
+    # each running job holds one thread for its blocking cache/filter/export steps
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+    keys = config.yt_api_keys or (config.yt_api_key,)
+    units_per_day = config.quota_units_per_day * len(keys)
+    client = AsyncYouTubeClient(
+        config.yt_api_key,
+        quota=AsyncQuotaScheduler(redis_async, units_per_day, config.quota_burst * len(keys), config.quota_max_wait),
+        key_pool=AsyncApiKeyPool(redis_async, keys, config.quota_units_per_day),
+        base_url=config.yt_base_url,
+    )
+    logger.info("Async worker started (concurrency=%s)", concurrency)
+    try:
+        while True:
+            await slots.acquire()
+            item = None
+            while item is None:
+                item = await redis_async.blpop([async_job_queue_key()], timeout=5)
+            _, raw = item
+            task = asyncio.create_task(_run_one(raw, client, slots))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        for task in running:
+            task.cancel()
+        await client.close()
+        await redis_async.aclose()
+
+
+def main() -> None:
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,158 @@
 from __future__ import annotations
 
+import asyncio
+import errno
 import json
 import logging
 import os
-import zlib
-from typing import Dict, List
+import tempfile
+import time
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 
 from app.config import Config
-from app.services.export import export_csv, export_json, export_xlsx
-from app.services.filtering import apply_filters
-from app.services.youtube import YouTubeClient
+from app.services.export import export_comments, output_compression
+from app.services.filtering import filter_pages, stream_filters
+from app.services.query import normalize_query
+from app.services.key_pool import ApiKeyPool
+from app.services.quota import QuotaScheduler
+from app.services.youtube import FetchCursor, YouTubeClient
+from app.services.youtube_async import AsyncYouTubeClient, BlockingYouTubeClient
 from app.storage.cache_keys import (
     job_cancel_key,
     job_progress_key,
     job_result_key,
     job_status_key,
-    yt_comments_cache_key,
+    yt_video_comments_key,
 )
+from app.storage.cache_budget import CacheBudget
+from app.storage.comment_cache import CacheEntry, CacheWriter, CommentCache
+from app.storage.decoded_cache import DecodedChunkCache
+from app.storage.export_artifacts import artifact_key, load_artifact, save_artifact, servable
+from app.storage.fetch_lock import FetchLock
 from app.storage.redis import get_redis_sync
 
 logger = logging.getLogger(__name__)
 
-CACHE_TTL_SECONDS = 60 * 60 * 12
 JOB_TTL_SECONDS = 60 * 60 * 4
+# how often a job waiting on another job's fetch of the same video checks back
+FETCH_WAIT_POLL_SECONDS = 1.0
+# where exports go when EXPORT_DIR is on a read-only filesystem
+FALLBACK_EXPORT_DIR = "/tmp/yt_exports"
 
 
-def _compress(data: List[Dict]) -> bytes:
-    raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
-    return zlib.compress(raw, level=6)
+_decoded_chunks: Optional[DecodedChunkCache] = None
 
 
-def _decompress(data: bytes) -> List[Dict]:
-    raw = zlib.decompress(data)
-    return json.loads(raw.decode("utf-8"))
+def _memory_tier(config: Config) -> Optional[DecodedChunkCache]:
+    # one per worker process, shared by the jobs it runs
+    global _decoded_chunks
+    if config.decoded_cache_mb <= 0:
+        return None
+    if _decoded_chunks is None:
+        _decoded_chunks = DecodedChunkCache(config.decoded_cache_mb * 1024 * 1024)
+    return _decoded_chunks
 
 
-def fetch_and_export(job_id: str, settings: Dict) -> str:
+def _read_only(path: str) -> bool:
+    # probed before exporting: the export consumes a one-shot stream, so it cannot be retried
+    try:
+        os.makedirs(path, exist_ok=True)
+        with tempfile.TemporaryFile(dir=path):
+            pass
+    except OSError as exc:
+        if exc.errno == errno.EROFS:
+            return True
+        raise
+    return False
+
+
+def _usable(entry: Optional[CacheEntry], limit: int) -> bool:
+    return bool(entry and entry.is_fresh() and entry.covers(limit))
+
+
+def _superset_pages(
+    fetch,
+    cache: CommentCache,
+    entry: Optional[CacheEntry],
+    limit: int,
+    cursor: FetchCursor,
+    writer: CacheWriter,
+    enough: Optional[Callable[[], bool]] = None,
+) -> Iterator[List[Dict]]:
+    # threads newer than a stale entry, then the entry itself, then the tail it is missing;
+    # new pages go to `writer`, the entry's chunks are reused as they are. `enough` is asked
+    # after every page past the refresh, so a filtered export stops once it has its matches
+    # (the refresh always runs to the old entry, or the new one would have a gap).
+    count = 0
+    if entry and not entry.is_fresh():
+        head = FetchCursor()
+        reached = False
+
+        def _known(comment: Dict) -> bool:
+            nonlocal reached
+            reached = reached or entry.is_known(comment)
+            return reached
+
+        for page in fetch(0, limit=limit, stop_before=_known, cursor=head):
+            writer.add(page)
+            count += len(page)
+            yield page
+        if not reached or count >= limit:
+            # more new threads than the limit: the refresh never got back to the entry (or
+            # stopped short of it), so splicing it on would leave a hole. Start over from here.
+            cache.discard(entry)
+            entry = None
+            writer.cursor = cursor = head
+    writer.attach(entry)
+    known = None
+    if entry:
+        if count + entry.count < limit:
+            known = set()
+        for chunk in cache.read(entry, limit - count):
+            if known is not None:
+                known.update(c.get("comment_id") for c in chunk)
+            yield chunk
+            if enough is not None and enough():
+                writer.finish()
+                return
+        count += entry.count
+    while count < limit and not cursor.exhausted:
+        # page tokens can shift once new threads arrive; drop anything we already hold and
+        # keep going until `limit` new comments are in or the listing runs out
+        position = cursor.to_dict()
+        for page in fetch(count, limit=limit - count, cursor=cursor):
+            page = [c for c in page if c.get("comment_id") not in known] if known else page
+            writer.add(page)
+            count += len(page)
+            yield page
+            if enough is not None and enough():
+                writer.finish()
+                return
+        if cursor.to_dict() == position:
+            break
+    writer.finish()
+
+
+def _until(pages: Iterable[List[Dict]], enough: Optional[Callable[[], bool]]) -> Iterator[List[Dict]]:
+    for page in pages:
+        yield page
+        if enough is not None and enough():
+            return
+
+
+def _build_client(config: Config, r) -> YouTubeClient:
+    keys = config.yt_api_keys or (config.yt_api_key,)
+    units_per_day = config.quota_units_per_day * len(keys)
+    return YouTubeClient(
+        config.yt_api_key,
+        quota=QuotaScheduler(r, units_per_day, config.quota_burst * len(keys), config.quota_max_wait),
+        key_pool=ApiKeyPool(r, keys, config.quota_units_per_day),
+        base_url=config.yt_base_url,
+    )
+
+
+def fetch_and_export(job_id: str, settings: Dict, client: Optional[YouTubeClient] = None) -> str:
     config = Config.from_env()
     r = get_redis_sync(config.redis_url)
 
@@ -48,6 +165,8 @@ def fetch_and_export(job_id: str, settings: Dict) -> str:
     def is_cancelled() -> bool:
         return bool(r.get(job_cancel_key(job_id)))
 
+    lock: Optional[FetchLock] = None
+    writer: Optional[CacheWriter] = None
     try:
         set_status("running")
         set_progress({"message": "Fetching comments...", "fetched": 0, "limit": settings.get("limit", config.default_limit)})
@@ -58,85 +177,217 @@ def fetch_and_export(job_id: str, settings: Dict) -> str:
 
         logger.info("Job %s started for video %s (limit=%s, replies=%s)", job_id, video_id, limit, include_replies)
 
-        cache_params = {
-            "limit": limit,
-            "include_replies": include_replies,
+        filters = {
+            "keywords": settings.get("keywords") or [],
+            "keywords_mode": settings.get("keywords_mode", "any"),
+            "keywords_case_sensitive": settings.get("keywords_case_sensitive", False),
+            "min_len": settings.get("min_len"),
+            "query": settings.get("query"),
+            "min_likes": settings.get("min_likes"),
+            "max_likes": settings.get("max_likes"),
+            "after": settings.get("after"),
+            "before": settings.get("before"),
         }
-        cache_key = yt_comments_cache_key(video_id, cache_params)
+        # with filters on, the job reads past the first `limit` comments looking for `limit`
+        # matches, up to the scan budget, and stops fetching as soon as it has them
+        filtering = bool(
+            any(k.strip() for k in filters["keywords"])
+            or (filters["min_len"] or 0) > 0
+            or normalize_query(filters["query"])
+            or any(filters[k] is not None for k in ("min_likes", "max_likes", "after", "before"))
+        )
+        scan_limit = max(limit, config.filter_scan_limit) if filtering else limit
+        scanned = 0
+        matched = 0
 
-        comments: List[Dict]
-        cached = r.get(cache_key)
-        if cached:
-            comments = _decompress(cached)
-            logger.info("Cache hit for %s", video_id)
-        else:
-            yt = YouTubeClient(config.yt_api_key)
-            def _on_progress(count: int) -> None:
-                if is_cancelled():
-                    raise RuntimeError("cancelled")
-                set_progress({"message": "Fetching comments...", "fetched": count, "limit": limit})
-
-            comments = yt.fetch_comments(
-                video_id=video_id,
-                limit=limit,
-                include_replies=include_replies,
-                progress_cb=_on_progress,
+        def _enough() -> bool:
+            return matched >= limit
+
+        enough = _enough if filtering else None
+
+        def _progress(message: str, fetched: int) -> Dict:
+            payload = {"message": message, "fetched": fetched, "limit": limit}
+            if filtering:
+                payload["scanned"] = min(scanned, scan_limit)
+                payload["matched"] = matched
+            return payload
+
+        # one entry per video and replies setting, whatever the limit; it records how far the
+        # fetch got so shorter requests are sliced from it and longer ones fetch only the tail
+        cache_key = yt_video_comments_key(video_id, include_replies)
+
+        pages: Iterator[List[Dict]]
+        budget = None
+        if config.cache_budget_mb > 0:
+            budget = CacheBudget(r, config.cache_budget_mb * 1024 * 1024, config.cache_admit_mb * 1024 * 1024)
+            budget.record_request(cache_key)
+        cache = CommentCache(r, memory=_memory_tier(config), budget=budget)
+
+        def _load() -> Optional[CacheEntry]:
+            loaded = cache.load(cache_key)
+            return loaded if loaded and loaded.cursor is not None else None
+
+        # single flight: one job fetches a video, the others wait for its entry and read that
+        lock = FetchLock(r, cache_key, job_id)
+        entry = _load()
+        while not _usable(entry, scan_limit) and not lock.acquire():
+            if is_cancelled():
+                raise RuntimeError("cancelled")
+            leader = lock.leader_progress()
+            set_progress(
+                {
+                    "message": "Waiting for a running fetch of this video...",
+                    "fetched": min(int(leader.get("fetched", 0)), limit),
+                    "limit": limit,
+                }
             )
-            r.setex(cache_key, CACHE_TTL_SECONDS, _compress(comments))
+            time.sleep(FETCH_WAIT_POLL_SECONDS)
+            entry = _load()
+        if lock.held:
+            # a leader may have published and released between the last load and the acquire:
+            # read its entry again rather than fetch from the older cursor over it
+            entry = _load()
+            if _usable(entry, scan_limit):
+                lock.release()
 
-        if is_cancelled():
-            raise RuntimeError("cancelled")
-        set_progress({"message": "Filtering...", "fetched": len(comments), "limit": limit})
-
-        filtered = apply_filters(
-            comments,
-            keywords=settings.get("keywords") or [],
-            keywords_mode=settings.get("keywords_mode", "any"),
-            keywords_case_sensitive=settings.get("keywords_case_sensitive", False),
-            min_len=settings.get("min_len"),
-            sort=settings.get("sort", "none"),
-            limit=limit,
-        )
+        def _done(result: Dict) -> None:
+            r.setex(job_result_key(job_id), JOB_TTL_SECONDS, json.dumps(result).encode("utf-8"))
+            set_status("done")
+            set_progress({"message": "Done", "fetched": result["count"], "limit": limit, "exported": True})
 
-        if is_cancelled():
-            raise RuntimeError("cancelled")
-        set_progress({"message": "Exporting...", "fetched": len(filtered), "limit": limit})
+        if _usable(entry, scan_limit):
+            # the same export of the same cache entry was made before: hand out that file
+            art_key = artifact_key(settings, entry.version, config.default_limit)
+            artifact = load_artifact(r, art_key)
+            if servable(artifact):
+                cache.hit(cache_key, entry)
+                _done(dict(artifact, artifact_key=art_key))
+                logger.info("Job %s reused export %s", job_id, artifact.get("file_path"))
+                return artifact.get("file_path") or ""
+            logger.info(
+                "Cache hit for %s (%s cached, memory tier %s)",
+                video_id,
+                entry.count,
+                cache.memory.stats() if cache.memory else "off",
+            )
+            if is_cancelled():
+                raise RuntimeError("cancelled")
+            set_progress(_progress("Filtering...", min(entry.count, limit)))
+            cache.hit(cache_key, entry)
+            keywords = [k for k in filters["keywords"] if k.strip()]
+            if keywords and config.comment_index:
+                # only the comments the chunks' word indexes point at; the filter rechecks them
+                pages = _until(
+                    cache.read_candidates(cache_key, entry, keywords, filters["keywords_mode"], scan_limit), enough
+                )
+            else:
+                pages = _until(cache.read(entry, scan_limit), enough)
+        else:
+            yt = client or _build_client(config, r)
+            cursor = FetchCursor.from_dict(entry.cursor) if entry else FetchCursor()
+            if entry:
+                # also how an interrupted or cancelled fetch is resumed: it published what it had
+                logger.info(
+                    "Extending cached comments for %s (%s cached, stale=%s)",
+                    video_id,
+                    entry.count,
+                    not entry.is_fresh(),
+                )
+
+            def _fetch(offset: int, **kwargs) -> Iterator[List[Dict]]:
+                def _on_progress(count: int) -> None:
+                    if is_cancelled():
+                        raise RuntimeError("cancelled")
+                    payload = _progress("Fetching comments...", offset + count)
+                    set_progress(payload)
+                    lock.report(payload)
+
+                return yt.iter_comment_pages(
+                    video_id=video_id,
+                    include_replies=include_replies,
+                    progress_cb=_on_progress,
+                    reply_workers=config.reply_workers,
+                    should_stop=is_cancelled,
+                    **kwargs,
+                )
+
+            fetched_at = entry.fetched_at if entry and entry.is_fresh() else time.time()
+            writer = cache.writer(cache_key, cursor, fetched_at)
+            pages = _superset_pages(_fetch, cache, entry, scan_limit, cursor, writer, enough)
+            art_key = None
+
+        def _scanned(items: Iterable[List[Dict]]) -> Iterator[List[Dict]]:
+            # the pages that make up the first `scan_limit` comments of the stream
+            nonlocal scanned
+            left = scan_limit
+            if left <= 0:
+                return
+            for page in items:
+                # index reads pass on only the candidates of the comments they looked at
+                scanned += getattr(page, "scanned", len(page))
+                if filtering:
+                    set_progress(_progress("Filtering...", min(scanned, scan_limit)))
+                if len(page) >= left:
+                    yield page[:left]
+                    return
+                left -= len(page)
+                yield page
+
+        def _matched(items: Iterable[Dict]) -> Iterator[Dict]:
+            nonlocal matched
+            for c in items:
+                matched += 1
+                yield c
+
+        # the stream carries everything that goes into the cache; exports take the first `limit`
+        # matches among its first `scan_limit` comments, filtered a page at a time
+        raw = _scanned(pages)
+
+        # pages flow through filtering into the exporter, so only the current page (or, for
+        # sorted output, the matches) is held in memory
+        exported = 0
+
+        def _counted(items: Iterable[Dict]) -> Iterator[Dict]:
+            nonlocal exported
+            for c in items:
+                exported += 1
+                yield c
+
+        matches = islice(_matched(filter_pages(raw, **filters)), limit)
+        filtered = _counted(stream_filters(matches, sort=settings.get("sort", "none"), limit=limit))
 
         export_dir = config.export_dir
         fmt = settings.get("format", "csv")
         fields = settings.get("fields") or ["author", "published_at", "like_count", "text"]
-        try:
-            if fmt == "xlsx":
-                path = export_xlsx(filtered, export_dir, video_id, fields)
-            elif fmt == "json":
-                path = export_json(filtered, export_dir, video_id, fields)
-            else:
-                path = export_csv(filtered, export_dir, video_id, fields)
-        except OSError as exc:
-            if getattr(exc, "errno", None) == 30:
-                fallback_dir = "/tmp/yt_exports"
-                logger.warning("Export dir read-only: %s. Falling back to %s", export_dir, fallback_dir)
-                set_progress({"message": "Export dir read-only, using /tmp", "fetched": len(filtered), "limit": limit})
-                if fmt == "xlsx":
-                    path = export_xlsx(filtered, fallback_dir, video_id, fields)
-                elif fmt == "json":
-                    path = export_json(filtered, fallback_dir, video_id, fields)
-                else:
-                    path = export_csv(filtered, fallback_dir, video_id, fields)
-            else:
-                raise
+        compress = output_compression(fmt, settings.get("compress"))
+        if _read_only(export_dir):
+            logger.warning("Export dir read-only: %s. Falling back to %s", export_dir, FALLBACK_EXPORT_DIR)
+            set_progress({"message": "Export dir read-only, using /tmp", "fetched": exported, "limit": limit})
+            export_dir = FALLBACK_EXPORT_DIR
+        path = export_comments(fmt, filtered, export_dir, video_id, fields, compress)
+
+        # run the fetch to completion so the cache entry gets written even when the export
+        # stopped at `limit` matches on the last fetched page
+        for _ in pages:
+            pass
+        if is_cancelled():
+            raise RuntimeError("cancelled")
 
         result = {
             "file_path": path,
-            "count": len(filtered),
+            "count": exported,
             "format": fmt,
+            "compress": compress,
             "video_id": video_id,
         }
-        r.setex(job_result_key(job_id), JOB_TTL_SECONDS, json.dumps(result).encode("utf-8"))
-        set_status("done")
-        set_progress({"message": "Done", "fetched": len(filtered), "limit": limit, "exported": True})
+        if art_key is None:
+            # the writer has published the entry by now, so its version is final
+            art_key = artifact_key(settings, writer.version, config.default_limit)
+        save_artifact(r, art_key, result)
+        result["artifact_key"] = art_key
+        _done(result)
 
-        logger.info("Job %s done: %s comments, file=%s", job_id, len(filtered), path)
+        logger.info("Job %s done: %s comments (%s scanned), file=%s", job_id, exported, scanned, path)
 
         return path
     except Exception as exc:
@@ -148,3 +399,21 @@ def fetch_and_export(job_id: str, settings: Dict) -> str:
         set_status("error")
         set_progress({"message": f"Error: {exc}", "fetched": 0, "exported": False})
         raise
+    finally:
+        if writer is not None:
+            # cancelled or failed mid-fetch: publish what was fetched, so the next job resumes
+            # from here (a no-op once the writer has finished)
+            try:
+                writer.checkpoint()
+            except Exception:
+                logger.exception("Job %s could not checkpoint the cache entry", job_id)
+        if lock is not None:
+            lock.release()
+
+
+async def fetch_and_export_async(job_id: str, settings: Dict, client: AsyncYouTubeClient) -> str:
+    # HTTP runs on the caller's event loop; cache, filtering and export stay blocking and run in
+    # the loop's default executor, so size that executor to the number of concurrent jobs.
+    loop = asyncio.get_running_loop()
+    bridge = BlockingYouTubeClient(client.for_job(), loop)
+    return await loop.run_in_executor(None, fetch_and_export, job_id, settings, bridge)